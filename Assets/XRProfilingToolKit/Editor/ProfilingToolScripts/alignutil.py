@@ -0,0 +1,63 @@
+#################################################################################################################
+## Copyright (c) 2024 PICO Developer
+## SPDX-License-Identifier: MIT
+## Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and#or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+## The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+## THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+################################################################################################################
+
+
+import numpy as np
+
+# piecewise linear mapping of the times of a session onto the timeline of another session
+# fromTimes and toTimes are the strictly increasing times of the anchors in both sessions, times between anchors are interpolated
+# and times before the first or after the last anchor keep their offset to it
+class TimeAlignment:
+    def __init__(self, fromTimes, toTimes, events = None):
+        self.fromTimes = np.asarray(fromTimes, dtype=np.float64)
+        self.toTimes = np.asarray(toTimes, dtype=np.float64)
+        self.events = events or []
+
+    def warp(self, times):
+        times = np.asarray(times, dtype=np.float64)
+        warped = np.interp(times, self.fromTimes, self.toTimes)
+        before = times < self.fromTimes[0]
+        warped[before] = times[before] - self.fromTimes[0] + self.toTimes[0]
+        after = times > self.fromTimes[-1]
+        warped[after] = times[after] - self.fromTimes[-1] + self.toTimes[-1]
+        return warped
+
+    def warp_time(self, time):
+        return float(self.warp([time])[0])
+
+    def to_json(self):
+        return {'anchors': len(self.events), 'events': self.events, 'from': self.fromTimes.tolist(), 'to': self.toTimes.tolist()}
+
+# identity alignment of the session other sessions are aligned to
+def get_identity_alignment():
+    return TimeAlignment([0.0], [0.0])
+
+# align the automation events of a session to the events of the base session, see parse_session_log
+# the nth occurrence of an event is matched with the nth occurrence of the same event in the base session. Matches out of order
+# with the previous ones, like an event logged once more by one of the sessions, are skipped so the mapping keeps increasing
+def align_session_events(baseEvents, otherEvents):
+    occurrences = {}
+    otherTimes = {}
+    for time, event in otherEvents:
+        occurrences[event] = occurrences.get(event, 0) + 1
+        otherTimes[(event, occurrences[event])] = time
+
+    # both sessions start with the automation
+    fromTimes = [0.0]
+    toTimes = [0.0]
+    events = []
+    occurrences = {}
+    for time, event in baseEvents:
+        occurrences[event] = occurrences.get(event, 0) + 1
+        otherTime = otherTimes.get((event, occurrences[event]))
+        if otherTime is None or otherTime <= fromTimes[-1] or time <= toTimes[-1]:
+            continue
+        fromTimes.append(otherTime)
+        toTimes.append(time)
+        events.append(event)
+    return TimeAlignment(fromTimes, toTimes, events)
@@ -10,11 +10,14 @@
 import argparse
 import os
 import webbrowser
-import json
-import shutil
 
 from datetime import datetime
 from parseutil import *
+from statsutil import BOOTSTRAP_SAMPLES, HIGHER_IS_BETTER_METRICS, compare_feature_samples, compare_samples, compute_feature_stats, compute_stats, get_threshold
+from hitchutil import detect_hitches, format_hitches
+from alignutil import align_session_events, get_identity_alignment
+from captureutil import CAPTURE_WINDOW, add_capture_diffs, add_capture_metrics, add_capture_thumbnails, build_report_thumbnails, format_session_time
+from reportutil import DEFAULT_MAX_POINTS, SERIES_DIR, SHARD_DIR, get_asset_store_dir, get_chart_series, get_report_template_dir, link_tree, write_report_config, write_series_script
 
 
 features = []
@@ -65,187 +68,209 @@ class ScreenCaptureCollection:
 
 # global variables
 samplefeatures = ["Foveation(High)", "MSAA(4x)", "Adaptive Resolution"]
-parser = argparse.ArgumentParser(description="Script to compare two XRProfilingToolkit sessions")
-
+parser = argparse.ArgumentParser(description="Script to compare XRProfilingToolkit sessions")
 
 # main
-parser.add_argument('-s', '--session', type=str, help="XRProfilingToolkit session result directories", required=True, nargs='+')
-parser.add_argument('-f','--features', type=str, help="XRProfilingToolkit session features")
-args = parser.parse_args()
+def main():
+    global samplefeatures
+    parser.add_argument('-s', '--session', type=str, help="XRProfilingToolkit session result directories, the first one is the baseline the others are compared with", required=True, nargs='+')
+    parser.add_argument('-f','--features', type=str, help="XRProfilingToolkit session features")
+    parser.add_argument('--no-cache', action='store_true', help="Parse the session logs again instead of using the parsed session cache")
+    parser.add_argument('--max-points', type=int, default=DEFAULT_MAX_POINTS, help="Number of points each metric chart is downsampled to per session, 0 to plot all points")
+    parser.add_argument('--base64', action='store_true', help="Store the chart data in the report as base64 encoded binary arrays")
+    parser.add_argument('--capture-window', type=float, default=CAPTURE_WINDOW, help="Seconds of metrics before and after each screen capture summarized on its card")
+    parser.add_argument('-m', '--metrics', type=str, help="Only parse and report these metrics, separated by | (like \"FPS|FrmGpu\"). Schema names and metrics names are accepted")
+    parser.add_argument('--bootstrap-samples', type=int, default=BOOTSTRAP_SAMPLES, help="Number of bootstrap resamples used for the confidence intervals of the differences between sessions")
+    parser.add_argument('--no-align', action='store_true', help="Plot the sessions against the time since their own start instead of aligning them on the automation events they log")
+    parser.add_argument('-j', '--workers', type=int, help="Number of worker processes parsing the session logs, defaults to the number of cpus")
+    args = parser.parse_args()
+    selectedMetrics = args.metrics.split('|') if args.metrics else None
     
-# Check if exactly two directories are provided
-if len(args.session) != 2 or not all(os.path.isdir(directory) for directory in args.session):
-    print('Please pass in two valid session directories')
-    exit()
+    # Check if at least two directories are provided
+    if len(args.session) < 2 or not all(os.path.isdir(directory) for directory in args.session):
+        print('Please pass in two or more valid session directories')
+        exit()
    
-if args.features:
-    input_features = args.features.split('|')
-    samplefeatures = [feature for feature in input_features if feature in samplefeatures]
-
-session1_dir = args.session[0]
-session2_dir = args.session[1]
-
-automationId1, metricsData1,start_time1,finish_time1 = get_metrics_data(session1_dir)
-automationId2, metricsData2,start_time2,finish_time2 = get_metrics_data(session2_dir)
-
-##### genertate report #####
-reportpathname = "comparison_report"+f"_{os.path.basename(session1_dir)}_{os.path.basename(session2_dir)}"
-source_file_path = os.path.join(session1_dir, "report_template")
-destination_file_path = os.path.join(session1_dir, reportpathname)
-shutil.copytree(source_file_path, destination_file_path, dirs_exist_ok=True)
-source_file_path = os.path.join(session1_dir+"/screencap", os.path.basename(session1_dir))
-destination_file_path = os.path.join(session1_dir+"/"+reportpathname+"/resource/captures", os.path.basename(session1_dir))
-shutil.copytree(source_file_path, destination_file_path, dirs_exist_ok=True)
-source_file_path = os.path.join(session2_dir+"/screencap", os.path.basename(session2_dir))
-destination_file_path = os.path.join(session1_dir+"/"+reportpathname+"/resource/captures", os.path.basename(session2_dir))
-shutil.copytree(source_file_path, destination_file_path, dirs_exist_ok=True)
-report_path = os.path.join(session1_dir+"/"+reportpathname, "index.html")
-
-if automationId1 != automationId2:
-    print("Automation ids are different, the comparison may not be valid!")
-    exit()
-
-# initialize report data
-config_json = {}
-config_json['type'] = "XR Profiling Session Comparison Report"
-config_json['name'] = []
-config_json['name'].append(os.path.basename(session1_dir))
-config_json['name'].append(os.path.basename(session2_dir))
-config_json['Automation Id'] = automationId1
-config_json['Device Spec'] = []
-config_json['DataSet'] = []
-config_json['Captures'] = {}
-# add device spec to report
-DevicesessionData1 = {}
-fDeviceSpec = open(os.path.join(session1_dir, "device_spec.log"), 'r')
-deviceSpecs = fDeviceSpec.readlines()
-for specLine in deviceSpecs:
-    if 'OS version' in specLine:
-        specLinesplit = specLine.split(':', 1)
-        DevicesessionData1['OS version'] = specLinesplit[1].replace('\n', '')
-    if 'Device name' in specLine:
-        specLinesplit = specLine.split(',', 1)
-        subspecLinesplit1 = specLinesplit[0].split(':', 1)
-        DevicesessionData1['Device name'] = subspecLinesplit1[1].replace('\n', '')
-        subspecLinesplit2 = specLinesplit[1].split(':', 1)
-        DevicesessionData1['Model'] = subspecLinesplit2[1].replace('\n', '')
-    if 'Default eye buffer size' in specLine:
-        specLinesplit = specLine.split(':', 1)
-        DevicesessionData1['Default eye buffer size'] = specLinesplit[1].replace('\n', '')
-DevicesessionData1['Start time(first frame)'] = start_time1.strftime('%Y-%m-%d %H:%M:%S.%MS')
-DevicesessionData1['End time'] = finish_time1.strftime('%Y-%m-%d %H:%M:%S.%MS')
-config_json['Device Spec'].append(DevicesessionData1)
-DevicesessionData2 = {}
-fDeviceSpec = open(os.path.join(session1_dir, "device_spec.log"), 'r')
-deviceSpecs = fDeviceSpec.readlines()
-for specLine in deviceSpecs:
-    if 'OS version' in specLine:
-        specLinesplit = specLine.split(':', 1)
-        DevicesessionData2['OS version'] = specLinesplit[1].replace('\n', '')
-    if 'Device name' in specLine:
-        specLinesplit = specLine.split(',', 1)
-        subspecLinesplit1 = specLinesplit[0].split(':', 1)
-        DevicesessionData2['Device name'] = subspecLinesplit1[1].replace('\n', '')
-        subspecLinesplit2 = specLinesplit[1].split(':', 1)
-        DevicesessionData2['Model'] = subspecLinesplit2[1].replace('\n', '')
-    if 'Default eye buffer size' in specLine:
-        specLinesplit = specLine.split(':', 1)
-        DevicesessionData2['Default eye buffer size'] = specLinesplit[1].replace('\n', '')
-DevicesessionData2['Start time(first frame)'] = start_time2.strftime('%Y-%m-%d %H:%M:%S.%MS')
-DevicesessionData2['End time'] = finish_time2.strftime('%Y-%m-%d %H:%M:%S.%MS')
-config_json['Device Spec'].append(DevicesessionData2)
-
-for name,data1 in metricsData1.items():
-    data2 = metricsData2[name]
-    if hasattr(data1, "timestamps") and hasattr(data2, "timestamps"):
+    if args.features:
+        input_features = args.features.split('|')
+        samplefeatures = [feature for feature in input_features if feature in samplefeatures]
+
+    session_dirs = args.session
+    session_names = [os.path.basename(os.path.normpath(session_dir)) for session_dir in session_dirs]
+    session1_dir = session_dirs[0]
+
+    # the logs of all sessions are parsed by one pool of worker processes
+    sessions = get_sessions_metrics_data(session_dirs, not args.no_cache, args.workers, selectedMetrics)
+    automationIds = [session[0] for session in sessions]
+    metricsDataList = [session[1] for session in sessions]
+    start_times = [session[2] for session in sessions]
+    finish_times = [session[3] for session in sessions]
+    featureTimelines = [session[4] for session in sessions]
+    valueColumnsList = [get_value_columns(metricsData) for metricsData in metricsDataList]
+    hitchesList = [detect_hitches(valueColumns) for valueColumns in valueColumnsList]
+    # the timelines of the sessions are warped onto the timeline of the first session between the automation events both logged,
+    # so the series, hitches, feature segments and captures line up event by event when the sessions ran at different speeds
+    # statistics keep the real time of each session
+    if args.no_align:
+        alignments = [get_identity_alignment() for session in sessions]
+    else:
+        alignments = [get_identity_alignment()] + [align_session_events(sessions[0][5], session[5]) for session in sessions[1:]]
+
+    ##### genertate report #####
+    reportpathname = "comparison_report"+"".join(f"_{name}" for name in session_names)
+    source_file_path = get_report_template_dir(session1_dir)
+    destination_file_path = os.path.join(session1_dir, reportpathname)
+    # template and captures are linked instead of copied where the file system allows
+    link_tree(source_file_path, destination_file_path, get_asset_store_dir(session1_dir))
+    for session_dir, session_name in zip(session_dirs, session_names):
+        source_file_path = os.path.join(session_dir+"/screencap", session_name)
+        destination_file_path = os.path.join(session1_dir+"/"+reportpathname+"/resource/captures", session_name)
+        link_tree(source_file_path, destination_file_path)
+    report_path = os.path.join(session1_dir+"/"+reportpathname, "index.html")
+
+    if any(automationId != automationIds[0] for automationId in automationIds):
+        print("Automation ids are different, the comparison may not be valid!")
+        exit()
+
+    # initialize report data
+    config_json = {}
+    config_json['type'] = "XR Profiling Session Comparison Report"
+    config_json['name'] = session_names
+    config_json['Automation Id'] = automationIds[0]
+    config_json['Device Spec'] = []
+    config_json['DataSet'] = []
+    config_json['Captures'] = {}
+    # add device spec to report
+    for i, session_dir in enumerate(session_dirs):
+        DevicesessionData = read_device_spec(session_dir)
+        DevicesessionData['Start time(first frame)'] = start_times[i].strftime('%Y-%m-%d %H:%M:%S.%MS')
+        DevicesessionData['End time'] = finish_times[i].strftime('%Y-%m-%d %H:%M:%S.%MS')
+        DevicesessionData['Hitches'] = format_hitches(hitchesList[i])
+        if i > 0 and not args.no_align:
+            DevicesessionData['Aligned Events'] = str(len(alignments[i].events))
+        config_json['Device Spec'].append(DevicesessionData)
+    config_json['Alignment'] = {name: alignment.to_json() for name, alignment in zip(session_names[1:], alignments[1:])}
+    # frame drops shown as bands on the metric charts
+    config_json['Hitches'] = {}
+    config_json['Feature Segments'] = {}
+    for name, hitches, featureTimeline, alignment in zip(session_names, hitchesList, featureTimelines, alignments):
+        config_json['Hitches'][name] = [dict(hitch, start=alignment.warp_time(hitch['start']), end=alignment.warp_time(hitch['end'])) for hitch in hitches]
+        config_json['Feature Segments'][name] = [dict(segment, start=alignment.warp_time(segment['start']), end=alignment.warp_time(segment['end'])) for segment in featureTimeline.get_segments()]
+
+    # metrics of all sessions in the order they first appear, a session without a metric has no series or statistics for it
+    metricNames = []
+    for metricsData in metricsDataList:
+        for name, data in metricsData.items():
+            if hasattr(data, "timestamps") and name not in metricNames:
+                metricNames.append(name)
+
+    resourceDir = os.path.join(session1_dir, reportpathname, "resource")
+    for name in metricNames:
+        sessionData = [(i, metricsData[name]) for i, metricsData in enumerate(metricsDataList) if hasattr(metricsData.get(name), "timestamps")]
         metricsData = {}
         metricsData['name'] = name
-        metricsData['desc'] = data1.description
-        metricsData['data'] = []
-        avg_value1 = 0
-        avg_value2 = 0
-        for i in range(0, len(data1.timestamps)):
-            subdata1 = {}
-            subdata1['x'] = data1.timestamps[i]
-            subdata1['y'] = data1.val[i]
-            subdata1['name'] = os.path.basename(session1_dir)
-            avg_value1 += data1.val[i]
-            metricsData['data'].append(subdata1)
-        for i in range(0, len(data2.timestamps)):
-            subdata2 = {}
-            subdata2['x'] = data2.timestamps[i]
-            subdata2['y'] = data2.val[i]
-            subdata2['name'] = os.path.basename(session2_dir)
-            avg_value2 += data2.val[i]
-            metricsData['data'].append(subdata2)
-        metricsData['value'] = "avg1: {:.2f}".format(avg_value1/len(data1.timestamps))+", "+"avg2: {:.2f}".format(avg_value2/len(data2.timestamps))
+        metricsData['desc'] = sessionData[0][1].description
+        # chart data is saved to a shard the report loads when the metric is shown
+        chartSeries = [get_chart_series(alignments[i].warp(data.timestamps), data.val, i, args.max_points) for i, data in sessionData]
+        metricsData['shard'] = write_series_script(resourceDir, SHARD_DIR, len(config_json['DataSet']), [series for series, _ in chartSeries], args.base64)
+        # keep all points in a separate file for zooming in
+        if any(downsampled for _, downsampled in chartSeries):
+            fullSeries = [get_chart_series(alignments[i].warp(data.timestamps), data.val, i, 0)[0] for i, data in sessionData]
+            metricsData['fullResolution'] = write_series_script(resourceDir, SERIES_DIR, len(config_json['DataSet']), fullSeries, args.base64)
+        # statistics are time weighted, the same as MetricsValue.average
+        metricsData['stats'] = {session_names[i]: compute_stats(data.timestamps, data.val, get_threshold(name, data)) for i, data in sessionData}
+        # statistics of each combination of feature states of the sessions
+        metricsData['featureStats'] = {session_names[i]: compute_feature_stats(data.timestamps, data.val, featureTimelines[i], get_threshold(name, data)) for i, data in sessionData}
+        # significance of the difference of each session to the first one, over the whole session and for each combination of feature states
+        metricsData['comparison'] = {}
+        if sessionData[0][0] == 0:
+            base = sessionData[0][1]
+            for i, data in sessionData[1:]:
+                comparison = compare_samples(base.timestamps, base.val, data.timestamps, data.val, name in HIGHER_IS_BETTER_METRICS, args.bootstrap_samples)
+                comparison['featureStates'] = compare_feature_samples(base.timestamps, base.val, featureTimelines[0], data.timestamps, data.val, featureTimelines[i], name in HIGHER_IS_BETTER_METRICS, args.bootstrap_samples)
+                metricsData['comparison'][session_names[i]] = comparison
+        averages = []
+        for i, session_name in enumerate(session_names):
+            stats = metricsData['stats'].get(session_name)
+            average = f"avg{i + 1}: " + ("{:.2f}".format(stats.get('mean', float('nan'))) if stats else "n/a")
+            if session_name in metricsData['comparison']:
+                average += " (" + metricsData['comparison'][session_name]['verdict'] + ")"
+            averages.append(average)
+        metricsData['value'] = ", ".join(averages)
         config_json['DataSet'].append(metricsData)
-config_json['Captures']['type'] = "comparison"
-config_json['Captures']['data'] = []
+    config_json['Captures']['type'] = "comparison"
+    config_json['Captures']['data'] = []
 
-session1_dir+"/"+reportpathname+"/resource/captures", os.path.basename(session1_dir)
-screencaps1 = glob.glob(os.path.join(session1_dir+"/"+reportpathname+"/resource/captures", os.path.basename(session1_dir), '*.png'))
-screencaps2 = glob.glob(os.path.join(session1_dir+"/"+reportpathname+"/resource/captures", os.path.basename(session2_dir), '*.png'))
+    screencapsList = [glob.glob(os.path.join(session1_dir+"/"+reportpathname+"/resource/captures", session_name, '*.png')) for session_name in session_names]
 
-scenename = os.path.basename(screencaps1[0]).split('_', 1)[0]
-config_json['Captures']['SceneName'] = scenename
+    screen_cap_lookups = {}
 
-screen_cap_lookups = {}
+    for i, screencaps in enumerate(screencapsList):
+        for path in screencaps:
+            key = os.path.basename(path).rsplit("_", 1)[0]
+            if key not in screen_cap_lookups:
+                screen_cap_lookups[key] = [""] * len(session_dirs)
+            screen_cap_lookups[key][i] = path
 
-for path in screencaps1:
-    key = os.path.basename(path).rsplit("_", 1)[0]
-    screen_cap_lookups[key] = [path, ""]
+    scenename = next(iter(screen_cap_lookups)).split('_', 1)[0] if screen_cap_lookups else ""
+    config_json['Captures']['SceneName'] = scenename
 
-for path in screencaps2:
-    key = os.path.basename(path).rsplit("_", 1)[0]
-    if key in screen_cap_lookups:
-        screen_cap_lookups[key][1] = path
-    else:
-        screen_cap_lookups[key] = ["", path]
-
-for name,data in screen_cap_lookups.items():
-    Capturedata = {}
-    Capturedata['Capture Content'] = os.path.basename(name).split('_', 2)[1]
-    Capturedata['info'] = []
-    Capturedata['same'] = {}
-    subCapture = []
-    subCapturebase1 = {}
-    subCapturebase2 = {}
-    sp_base_path = data[0]
-    sp_path = data[1]
-    sp_base_name = os.path.basename(sp_base_path)
-    sp_name = os.path.basename(sp_path)
-    cap_time_str = sp_base_name.split('_', -1)[-1].split('.', 1)[0]
-    cap_time = datetime.strptime(cap_time_str[:17], '%Y%m%d%H%M%S%f')
-    subCapturebase1['src'] = "./resource/captures/"+os.path.basename(session1_dir)+"/"+sp_base_name
-    subCapturebase1['Capture Time'] = cap_time_str[:4]+"-"+cap_time_str[4:6]+"-"+cap_time_str[6:8]+" "+cap_time_str[8:10]+":"+cap_time_str[10:12]+":"+cap_time_str[12:14]+"."+cap_time_str[14:17]
-    subCapturebase1['Frame Index'] = str((cap_time-start_time1).seconds)
-    cap_time_str = sp_name.split('_', -1)[-1].split('.', 1)[0]
-    cap_time = datetime.strptime(cap_time_str[:17], '%Y%m%d%H%M%S%f')
-    subCapturebase2['src'] = "./resource/captures/"+os.path.basename(session2_dir)+"/"+sp_name
-    subCapturebase2['Capture Time'] = cap_time_str[:4]+"-"+cap_time_str[4:6]+"-"+cap_time_str[6:8]+" "+cap_time_str[8:10]+":"+cap_time_str[10:12]+":"+cap_time_str[12:14]+"."+cap_time_str[14:17]
-    subCapturebase2['Frame Index'] = str((cap_time-start_time2).seconds)
-    feature_flags = sp_name.rsplit('_',2)[-2]
-    if feature_flags != "None":
-        for i in range(len(samplefeatures)):
-            if feature_flags[i] == '1':
-                Capturedata['same'][samplefeatures[i]] = "On"
-            elif feature_flags[i] == '0':
-                Capturedata['same'][samplefeatures[i]] = "Off"
-            else:
-                Capturedata['same'][samplefeatures[i]] = "Unknown"
-    subCapture.append(subCapturebase1)
-    subCapture.append(subCapturebase2)
-    Capturedata['info'].append(subCapture)
-    config_json['Captures']['data'].append(Capturedata)
-# save config.js file
-config_json_str = json.dumps(config_json, indent=4)
-config_path = os.path.join(session1_dir+"/"+reportpathname+"/resource", "config.js")
-fconfig = open(config_path, "w")
-fconfig.write('window.configJSON = ')
-fconfig.write(config_json_str)
-print(f"Comparison report generated to {report_path}")
-
-# open the report in web browser
-webbrowser.open_new(report_path)
+    for name,data in screen_cap_lookups.items():
+        Capturedata = {}
+        Capturedata['Capture Content'] = os.path.basename(name).split('_', 2)[1]
+        Capturedata['info'] = []
+        Capturedata['same'] = {}
+        subCapture = []
+        for i, sp_path in enumerate(data):
+            subCapturebase = {}
+            if not sp_path:
+                # the session has no capture of this view, its place in the entry is kept
+                subCapturebase['src'] = ""
+                subCapturebase['Capture Time'] = "missing"
+                subCapture.append(subCapturebase)
+                continue
+            sp_name = os.path.basename(sp_path)
+            cap_time_str = sp_name.split('_', -1)[-1].split('.', 1)[0]
+            cap_time = datetime.strptime(cap_time_str[:17], '%Y%m%d%H%M%S%f')
+            subCapturebase['src'] = "./resource/captures/"+session_names[i]+"/"+sp_name
+            subCapturebase['Capture Time'] = cap_time_str[:4]+"-"+cap_time_str[4:6]+"-"+cap_time_str[6:8]+" "+cap_time_str[8:10]+":"+cap_time_str[10:12]+":"+cap_time_str[12:14]+"."+cap_time_str[14:17]
+            subCapturebase['Session Time'] = format_session_time((cap_time-start_times[i]).total_seconds())
+            subCapture.append(subCapturebase)
+        feature_flags = os.path.basename(name).rsplit('_',1)[-1]
+        if feature_flags != "None":
+            for i in range(len(samplefeatures)):
+                if feature_flags[i] == '1':
+                    Capturedata['same'][samplefeatures[i]] = "On"
+                elif feature_flags[i] == '0':
+                    Capturedata['same'][samplefeatures[i]] = "Off"
+                else:
+                    Capturedata['same'][samplefeatures[i]] = "Unknown"
+        Capturedata['info'].append(subCapture)
+        config_json['Captures']['data'].append(Capturedata)
+    # thumbnails shown in place of the full resolution captures
+    thumbnails = build_report_thumbnails(os.path.join(session1_dir, reportpathname), get_asset_store_dir(session1_dir))
+    add_capture_thumbnails(config_json['Captures'], thumbnails)
+    # image difference of each session's capture against the first session's capture
+    add_capture_diffs(config_json['Captures'], os.path.join(session1_dir, reportpathname), get_asset_store_dir(session1_dir))
+    # metrics logged around each capture
+    add_capture_metrics(config_json['Captures'], [
+        (start_times[i], valueColumnsList[i], get_pil_metrics_names(session_dir, selectedMetrics)) for i, session_dir in enumerate(session_dirs)
+    ], args.capture_window)
+    # time of the captures on the timeline of the first session
+    if not args.no_align:
+        for captureData in config_json['Captures']['data']:
+            for subCapture in captureData['info']:
+                for i, capture in enumerate(subCapture[1:], 1):
+                    if 'metrics' in capture:
+                        capture['Aligned Time'] = "{:.3f} s".format(alignments[i].warp_time(capture['metrics']['time']))
+    # save config.js file
+    config_path = os.path.join(session1_dir+"/"+reportpathname+"/resource", "config.js")
+    write_report_config(config_path, config_json, args.base64)
+    print(f"Comparison report generated to {report_path}")
+
+    # open the report in web browser
+    webbrowser.open_new(report_path)
 
+# metrics logs may be parsed in worker processes which import this module, only run the script in the main process
+if __name__ == "__main__":
+    main()
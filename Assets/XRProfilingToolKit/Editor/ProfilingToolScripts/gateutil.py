@@ -0,0 +1,186 @@
+#################################################################################################################
+## Copyright (c) 2024 PICO Developer
+## SPDX-License-Identifier: MIT
+## Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and#or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+## The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+## THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+################################################################################################################
+
+
+import json
+import xml.etree.ElementTree as ET
+
+from parseutil import get_schema_columns
+from statsutil import HIGHER_IS_BETTER_METRICS, compare_feature_samples, compare_samples, compute_feature_stats, compute_stats, get_threshold
+
+##### performance budget gate #####
+# a session passes the gate when it meets every budget of the budget file and, given a baseline session, every statistic of every metric
+# is within the tolerance of the baseline. The budget file is json like
+# {
+#     "budgets": [
+#         {"metric": "FrmGpu", "stat": "p95", "max": 11.1},
+#         {"metric": "FPS", "stat": "p1", "min": 70},
+#         {"metric": "FrmGpu", "stat": "mean", "max": 10.5, "features": "110"}
+#     ],
+#     "baseline": {"stats": ["mean", "p95"], "tolerance": 0.05, "metrics": {"FrmGpu": 0.03}, "features": {"110": 0.08}}
+# }
+# metrics are given by their schema name (like FrmGpu) or metrics name (like fps or FrameTime.GPU). A budget with features only applies
+# to the samples of that combination of feature states, given by its flags (like 110) or label (like FFR:On, MSAA:On, AdaptiveResolution:Off)
+# baseline tolerances are fractions of the baseline value, per metric and per feature state. The tolerance of a feature state wins over the
+# tolerance of its metric, then come the tolerance given on the command line (gate.py --tolerance), the tolerance of the budget file
+# and DEFAULT_GATE_TOLERANCE
+DEFAULT_GATE_STATS = ["mean", "p95"]
+DEFAULT_GATE_TOLERANCE = 0.05
+
+def load_budget_file(path):
+    with open(path, "r") as fBudget:
+        budget = json.load(fBudget)
+    for entry in budget.get('budgets', []):
+        if 'metric' not in entry or 'stat' not in entry or ('min' not in entry and 'max' not in entry):
+            raise ValueError(f"Budget {entry} needs a metric, a stat and a min or max")
+    return budget
+
+# metrics named by a budget file, used to only parse the metrics the gate checks
+def get_budget_metrics(budget):
+    return list(dict.fromkeys(entry['metric'] for entry in budget.get('budgets', [])))
+
+# value column of a metric given by its metrics name or schema name, None if the session has no such metric
+def resolve_metric(name, columns, schemaColumns):
+    if name in columns:
+        return name
+    for column in columns:
+        if column.casefold() == name.casefold():
+            return column
+    column = schemaColumns.get(name.casefold())
+    return column if column in columns else None
+
+def is_higher_better(column):
+    return column.split(".", 1)[0] in HIGHER_IS_BETTER_METRICS
+
+# samples of a column in the combination of feature states given by its flags or label, None if the session never was in it
+def get_feature_stats(column, metrics, timeline, features):
+    for featureStats in compute_feature_stats(metrics.timestamps, metrics.val, timeline, get_threshold(column, metrics)):
+        if features in (featureStats['flags'], featureStats['features']):
+            return featureStats['stats']
+    return None
+
+def make_check(name, metric, stat, features, value, passed, message, **fields):
+    check = {'name': name, 'metric': metric, 'stat': stat, 'features': features, 'value': value, 'passed': passed, 'message': message}
+    check.update(fields)
+    return check
+
+# check a session against the budgets of a budget file. session is (value columns, feature timeline, session directory)
+def evaluate_budgets(budget, session):
+    columns, timeline, sessionDir = session
+    schemaColumns = get_schema_columns(sessionDir)
+    checks = []
+    for entry in budget.get('budgets', []):
+        metric = entry['metric']
+        stat = entry['stat']
+        features = entry.get('features')
+        limits = " and ".join(f"{'>=' if key == 'min' else '<='} {entry[key]:g}" for key in ['min', 'max'] if key in entry)
+        name = f"{metric} {stat} {limits}" + (f" [{features}]" if features else "")
+        column = resolve_metric(metric, columns, schemaColumns)
+        if column is None:
+            checks.append(make_check(name, metric, stat, features, None, False, f"{metric} is not in the session"))
+            continue
+        metrics = columns[column]
+        stats = get_feature_stats(column, metrics, timeline, features) if features else compute_stats(metrics.timestamps, metrics.val, get_threshold(column, metrics))
+        if stats is None or stats['count'] == 0 or stat not in stats:
+            checks.append(make_check(name, metric, stat, features, None, False, f"{metric} has no {stat} " + (f"in feature state {features}" if features else "in the session")))
+            continue
+        value = stats[stat]
+        passed = ('min' not in entry or value >= entry['min']) and ('max' not in entry or value <= entry['max'])
+        checks.append(make_check(name, metric, stat, features, value, passed, f"{metric} {stat} is {value:.3f}, budget {limits}", min=entry.get('min'), max=entry.get('max')))
+    return checks
+
+# tolerance of a statistic, tolerance is the one given on the command line or None, see the budget file above
+def get_tolerance(baselineConfig, column, features, tolerance, schemaColumns):
+    if features is not None and features in baselineConfig.get('features', {}):
+        return baselineConfig['features'][features]
+    metrics = baselineConfig.get('metrics', {})
+    for name in metrics:
+        if name.casefold() == column.casefold() or schemaColumns.get(name.casefold()) == column:
+            return metrics[name]
+    if tolerance is not None:
+        return tolerance
+    return baselineConfig.get('tolerance', DEFAULT_GATE_TOLERANCE)
+
+# statistic of a session worse than the baseline by more than its tolerance
+def check_against_baseline(name, column, stat, features, value, baselineValue, tolerance, significance):
+    higherIsBetter = is_higher_better(column)
+    change = value - baselineValue
+    worse = -change if higherIsBetter else change
+    allowed = abs(baselineValue) * tolerance
+    passed = worse <= allowed
+    message = f"{column} {stat} is {value:.3f}, baseline {baselineValue:.3f} ({change:+.3f}, tolerance {tolerance * 100:g}%)"
+    if not passed and significance is not None and significance['verdict'] != "regressed":
+        # the difference is within the noise of the sessions
+        passed = True
+        message += f", {significance['verdict']}"
+    return make_check(name, column, stat, features, value, passed, message, baseline=baselineValue, tolerance=tolerance)
+
+# check every statistic of every metric of a session against a baseline session, over the whole session and for each feature state
+# both sessions were in. Sessions are (value columns, feature timeline, session directory)
+# with requireSignificance, a change beyond the tolerance only fails when the block bootstrap and Mann-Whitney test find the session regressed
+# a metric that can't be compared fails: a given metric missing from either session, or a metric of the baseline missing from the session
+def evaluate_baseline(budget, session, baseline, tolerance = None, requireSignificance = False, metrics = None):
+    columns, timeline, sessionDir = session
+    baselineColumns, baselineTimeline, baselineDir = baseline
+    baselineConfig = budget.get('baseline', {}) if budget else {}
+    stats = baselineConfig.get('stats', DEFAULT_GATE_STATS)
+    schemaColumns = get_schema_columns(sessionDir)
+    baselineSchemaColumns = get_schema_columns(baselineDir)
+    checks = []
+    names = []
+    for metric in (metrics if metrics is not None else baselineColumns):
+        column = resolve_metric(metric, columns, schemaColumns)
+        inBaseline = column in baselineColumns if column is not None else resolve_metric(metric, baselineColumns, baselineSchemaColumns) is not None
+        missing = (["the session"] if column is None else []) + ([] if inBaseline else ["the baseline"])
+        if missing:
+            checks.append(make_check(f"{metric} vs baseline", metric, None, None, None, False, f"{metric} is not in {' or '.join(missing)}"))
+            continue
+        names.append(column)
+    for column in dict.fromkeys(names):
+        data = columns[column]
+        baseData = baselineColumns[column]
+        threshold = get_threshold(column, data)
+        parts = [(None, compute_stats(data.timestamps, data.val, threshold), compute_stats(baseData.timestamps, baseData.val, threshold))]
+        baseFeatureStats = {featureStats['flags']: featureStats for featureStats in compute_feature_stats(baseData.timestamps, baseData.val, baselineTimeline, threshold)}
+        for featureStats in compute_feature_stats(data.timestamps, data.val, timeline, threshold):
+            if featureStats['flags'] in baseFeatureStats:
+                parts.append((featureStats['flags'], featureStats['stats'], baseFeatureStats[featureStats['flags']]['stats']))
+        significance = {}
+        if requireSignificance:
+            significance[None] = compare_samples(baseData.timestamps, baseData.val, data.timestamps, data.val, is_higher_better(column))
+            for comparison in compare_feature_samples(baseData.timestamps, baseData.val, baselineTimeline, data.timestamps, data.val, timeline, is_higher_better(column)):
+                significance[comparison['flags']] = comparison
+        for features, sessionStats, baselineStats in parts:
+            if sessionStats['count'] == 0 or baselineStats['count'] == 0:
+                continue
+            for stat in stats:
+                name = f"{column} {stat} vs baseline" + (f" [{features}]" if features else "")
+                metricTolerance = get_tolerance(baselineConfig, column, features, tolerance, schemaColumns)
+                checks.append(check_against_baseline(name, column, stat, features, sessionStats[stat], baselineStats[stat], metricTolerance, significance.get(features)))
+    return checks
+
+def get_gate_result(sessionName, baselineName, checks):
+    return {
+        'session': sessionName,
+        'baseline': baselineName,
+        'passed': all(check['passed'] for check in checks),
+        'failures': sum(1 for check in checks if not check['passed']),
+        'checks': checks,
+    }
+
+def format_junit(result):
+    testsuites = ET.Element('testsuites')
+    testsuite = ET.SubElement(testsuites, 'testsuite', name="xr-profiling-gate", tests=str(len(result['checks'])), failures=str(result['failures']))
+    for check in result['checks']:
+        testcase = ET.SubElement(testsuite, 'testcase', classname=result['session'], name=check['name'])
+        if not check['passed']:
+            failure = ET.SubElement(testcase, 'failure', message=check['message'])
+            failure.text = check['message']
+        else:
+            ET.SubElement(testcase, 'system-out').text = check['message']
+    return ET.tostring(testsuites, encoding='unicode')
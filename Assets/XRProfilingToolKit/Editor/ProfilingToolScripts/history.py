@@ -0,0 +1,100 @@
+#################################################################################################################
+## Copyright (c) 2024 PICO Developer
+## SPDX-License-Identifier: MIT
+## Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and#or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+## The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+## THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+################################################################################################################
+
+
+import argparse
+import json
+import os
+import sys
+
+from historyutil import HISTORY_DB_NAME, HISTORY_STATS, HistoryStore, find_session_dirs
+from reportutil import DEFAULT_MAX_POINTS
+
+parser = argparse.ArgumentParser(description="Script to keep the summary of XRProfilingToolkit sessions in a local database and query their trends")
+
+def add_filter_arguments(subparser):
+    subparser.add_argument('--device', type=str, help="Only sessions of this device name")
+    subparser.add_argument('--serial', type=str, help="Only sessions of the device with this serial number")
+    subparser.add_argument('--automation-id', type=str, help="Only sessions of this automation id")
+    subparser.add_argument('--since', type=str, help="Only sessions started at or after this date, like 2025-01-28 or 2025-01-28T10:00")
+    subparser.add_argument('--until', type=str, help="Only sessions started before this date")
+    subparser.add_argument('--json', action='store_true', help="Print the result as json")
+
+def print_rows(rows, columns, asJson):
+    if asJson:
+        print(json.dumps(rows, indent=2))
+        return
+    widths = [max([len(column)] + [len(format_value(row[column])) for row in rows]) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(format_value(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+def format_value(value):
+    if isinstance(value, float):
+        return "{:.3f}".format(value)
+    return "" if value is None else str(value)
+
+# main
+def main():
+    parser.add_argument('--db', type=str, default=HISTORY_DB_NAME, help="History database path")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ingest = subparsers.add_parser('ingest', help="Add parsed sessions to the history")
+    ingest.add_argument('-s', '--session', type=str, nargs='+', required=True, help="Session directories, or output folders holding session directories")
+    ingest.add_argument('--series', action='store_true', help="Also keep the downsampled series of each metric")
+    ingest.add_argument('--max-points', type=int, default=DEFAULT_MAX_POINTS, help="Number of points of the kept series")
+    ingest.add_argument('--force', action='store_true', help="Add sessions again that are already in the history")
+    ingest.add_argument('--no-cache', action='store_true', help="Parse the session logs again instead of using the parsed session cache")
+    ingest.add_argument('-m', '--metrics', type=str, help="Only add these metrics, separated by | (like \"FPS|FrmGpu\")")
+    ingest.add_argument('-j', '--workers', type=int, help="Number of worker processes parsing the session logs, defaults to the number of cpus")
+
+    sessions = subparsers.add_parser('sessions', help="List the sessions in the history")
+    add_filter_arguments(sessions)
+
+    trend = subparsers.add_parser('trend', help="Print a statistic of a metric over the sessions in the history")
+    trend.add_argument('metric', type=str, help="Metric name or schema name, like fps or FrmGpu")
+    trend.add_argument('--stat', type=str, default='mean', choices=HISTORY_STATS, help="Statistic of the metric in each session, like mean, p95 or fractionBelow")
+    add_filter_arguments(trend)
+
+    subparsers.add_parser('metrics', help="List the metrics in the history")
+    args = parser.parse_args()
+
+    store = HistoryStore(args.db)
+    try:
+        if args.command == 'ingest':
+            sessionDirs = find_session_dirs(args.session)
+            if not sessionDirs:
+                print("No session directories found")
+                sys.exit(1)
+            added, failed = store.ingest(sessionDirs, not args.no_cache, args.workers, args.metrics.split('|') if args.metrics else None, args.max_points if args.series else 0, args.force)
+            for sessionDir, e in failed:
+                print(f"Failed to add {sessionDir}: {type(e).__name__}: {e}", file=sys.stderr)
+            print(f"Added {len(added)} of {len(sessionDirs)} sessions to {os.path.abspath(args.db)}")
+            if failed:
+                sys.exit(1)
+        elif args.command == 'sessions':
+            rows = store.get_sessions(args.device, args.serial, args.automation_id, args.since, args.until)
+            print_rows(rows, ['name', 'start_time', 'device', 'model', 'os_version', 'serial', 'automation_id', 'hitches'], args.json)
+        elif args.command == 'trend':
+            metric = store.resolve_metric(args.metric)
+            if metric is None:
+                print(f"Unknown metric {args.metric}, see history.py metrics", file=sys.stderr)
+                sys.exit(1)
+            rows = store.get_trend(metric, args.stat, args.device, args.serial, args.automation_id, args.since, args.until)
+            print_rows(rows, ['name', 'start_time', 'device', 'serial', 'value'], args.json)
+        elif args.command == 'metrics':
+            metricNames = store.get_metric_names()
+            for metric in store.get_metrics():
+                names = [name for name in metricNames.get(metric, []) if name != metric.casefold()]
+                print(f"{metric} ({', '.join(names)})" if names else metric)
+    finally:
+        store.close()
+
+# metrics logs may be parsed in worker processes which import this module, only run the script in the main process
+if __name__ == "__main__":
+    main()
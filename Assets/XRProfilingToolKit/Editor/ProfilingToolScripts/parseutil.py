@@ -8,78 +8,546 @@
 # Author: Xutong Zhou (xutong.zhou@bytedance.com)
 
 from parse import *
+from parse import compile as parse_compile, int_convert
 import dateutil.parser 
+import calendar
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 import os
+import re
 from datetime import datetime, timedelta
 import glob
+import hashlib
+import io
 import json
+import mmap
+import numpy as np
+
+from statsutil import weighted_mean
 
 @with_pattern(r'([A-Za-z]{1}[A-Za-z\d_]*\.)+[A-Za-z][A-Za-z\d_]*')
 def parse_package_name(text):
     return text
 
-def parse_metrics(metricsSchema, metricsDesc, dataEntries, key_val_separator):
+def parse_int(text):
+    try:
+        return int(text)
+    except ValueError:
+        # hex, binary and octal numbers are handled the same way as the parse library does
+        return int_convert()(text, None)
+
+# field types that can be matched with a hand built regex, patterns and conversions are the same as the parse library
+SIMPLE_FIELD_TYPES = {
+    'd': (r'[-+ ]?\d+|[-+ ]?0[xX][0-9a-fA-F]+|[-+ ]?0[bB][01]+|[-+ ]?0[oO][0-7]+', parse_int),
+    'f': (r'[-+ ]?\d*\.\d+', float),
+    'w': (r'\w+', str),
+}
+
+TEMPLATE_FIELD_REGEX = re.compile(r'\{([A-Za-z_][\w.]*)(?::([^{}]*))?\}')
+
+class MetricsTemplate:
+    def __init__(self, template):
+        self.template = template
+        self.fields = []
+        self.regex = None
+        self.converters = []
+        self.parser = None
+
+        pattern = ""
+        simple = '{{' not in template and '}}' not in template
+        pos = 0
+        for m in TEMPLATE_FIELD_REGEX.finditer(template):
+            self.fields.append(m.group(1))
+            if m.group(2) not in SIMPLE_FIELD_TYPES:
+                simple = False
+            if simple:
+                fieldPattern, converter = SIMPLE_FIELD_TYPES[m.group(2)]
+                pattern += re.escape(template[pos:m.start()]) + f"({fieldPattern})"
+                self.converters.append((m.group(1), converter))
+            pos = m.end()
+        literal = template[pos:]
+        if simple and '{' not in literal and '}' not in literal and len(self.fields) == len(set(self.fields)):
+            # parse library matches case insensitively by default
+            self.regex = re.compile(pattern + re.escape(literal), re.IGNORECASE | re.DOTALL)
+        else:
+            self.parser = parse_compile(template, {"package_name" : parse_package_name})
+
+    # return the matched fields, or None if the text doesn't match the template
+    def search(self, text):
+        if self.parser is not None:
+            matched = self.parser.search(text)
+            return matched.named if matched else None
+        matched = self.regex.search(text)
+        if not matched:
+            return None
+        groups = matched.groups()
+        return {field: converter(groups[i]) for i, (field, converter) in enumerate(self.converters)}
+
+# metrics schema with templates compiled and metric names and descriptions resolved once
+# selectedMetrics limits the schema to the listed metrics, matched by schema name (like FrmGpu) or metrics name (like fps or FrameTime.GPU)
+class MetricsSchema:
+    def __init__(self, schemaJson, selectedMetrics = None):
+        self.metric_splitter = schemaJson['metric_splitter']
+        self.key_val_separator = schemaJson['key_val_separator']
+        self.line_splitter = schemaJson["line_splitter"]
+        # schema metric key to compiled template
+        self.templates = {}
+        # template field (like fps.value) to metrics name (like fps), ignored fields are excluded
+        self.metricNames = {}
+        # metrics id (template field without the matched type) to description
+        self.descriptions = {}
+
+        if selectedMetrics is not None:
+            selectedMetrics = {name.strip().casefold() for name in selectedMetrics}
+
+        for metric in schemaJson['metrics']:
+            if metric['enabled'] == 0:
+                continue
+            template = MetricsTemplate(metric['template'])
+            # entries of unselected metrics are skipped by key before any template matching
+            if not is_metric_selected(metric['name'], template, selectedMetrics):
+                continue
+            self.templates[metric['name']] = template
+            for field in template.fields:
+                if "ignore" not in field:
+                    self.metricNames[field] = field.split(".", 1)[0]
+                if 'description' in metric:
+                    # convert field to value name, exclude the matched type (like value, unit)
+                    self.descriptions['.'.join(field.split('.')[:-1])] = metric['description']
+
+    def add_descriptions(self, metricsData):
+        for metricsId in self.descriptions:
+            mName = metricsId.split('.')[0]
+            if mName in metricsData:
+                metricsData[mName].add_description(metricsId, self.descriptions[metricsId])
+
+def is_metric_selected(name, template, selectedMetrics):
+    if selectedMetrics is None:
+        return True
+    names = {name}
+    for field in template.fields:
+        names.add(field.split(".", 1)[0])
+        names.add(field.rsplit(".", 1)[0])
+    return any(n.casefold() in selectedMetrics for n in names)
+
+def parse_metrics(metricsSchema, dataEntries):
     res = {}
-    desc = {}
     for entry in dataEntries:
-        keyVal = entry.split(key_val_separator)
-        keyVal[0] = keyVal[0].strip()
-        keyVal[1] = keyVal[1].strip()
-        if keyVal[0] in metricsSchema.keys():
-            matched = search(metricsSchema[keyVal[0]], keyVal[1], 0, None, {"package_name" : parse_package_name}).named
-            # add metrics description
-            if keyVal[0] in metricsDesc:
-                for pattern in matched:
-                    # convert matched pattern to value name, exclude the matched type (like value, unit)
-                    metricsId = '.'.join(pattern.split('.')[:-1])
-                    desc[metricsId] = metricsDesc[keyVal[0]]               
+        keyVal = entry.split(metricsSchema.key_val_separator)
+        template = metricsSchema.templates.get(keyVal[0].strip())
+        if template is None:
+            continue
+        matched = template.search(keyVal[1].strip())
+        if matched:
             res.update(matched)
-    return res, desc
+    return res
 
-# generate metrics data for the given session
-def get_metrics_data(sessionDir):
-    adb_timestamp_format = "%m-%d %H:%M:%S.%f"
-    current_year = dateutil.parser.parse(sessionDir, fuzzy=True).year
+# group parsed metrics by metrics name
+def group_metrics(metricsSchema, parsedMetrics):
+    lineData = {}
+    for metric in parsedMetrics:
+        name = metricsSchema.metricNames.get(metric)
+        if name is None:
+            continue
+        if lineData.get(name) == None:
+            lineData[name] = []
+        lineData[name].append((metric, parsedMetrics[metric]))
+    return lineData
 
-    ##### read start time, finish time and id from the xrprofilingtoolkit log #####
-    fXRProfilingToolkitLog = open(os.path.join(sessionDir, "xr_profilingtoolkit.log"), "r")
-    logLines = fXRProfilingToolkitLog.readlines()
+# growable numpy column with amortized appends, the filled part is returned as a view without copying
+class ColumnBuffer:
+    def __init__(self, dtype=np.float64, capacity=256):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
 
-    automationId = ""
+    def __len__(self):
+        return self.size
 
-    for line in logLines:
-        if not line:
-            continue
-        time_str = line[0:18]
-        time = datetime.strptime(f"{current_year} {time_str}", f"%Y {adb_timestamp_format}")
-        if "starting" in line:
-            start_time = time
-            automationId = line.split(":")[-1].strip()
-        if "finished" in line:
-            finish_time = time
+    def reserve(self, capacity):
+        if capacity > len(self.data):
+            data = np.empty(max(capacity, 2 * len(self.data)), dtype=self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+
+    def append(self, value):
+        if self.size == len(self.data):
+            self.reserve(self.size + 1)
+        self.data[self.size] = value
+        self.size += 1
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.data.dtype)
+        self.reserve(self.size + len(values))
+        self.data[self.size:self.size + len(values)] = values
+        self.size += len(values)
+
+    def view(self):
+        return self.data[:self.size]
+
+    # wrap an existing array (like a memory mapped cache column) without copying it
+    @staticmethod
+    def wrap(data):
+        column = ColumnBuffer(data.dtype, 0)
+        column.data = data
+        column.size = len(data)
+        return column
+
+LOGCAT_TIME_REGEX = re.compile(r'\d\d-\d\d \d\d:\d\d:\d\d\.\d\d\d')
+SESSION_TIME_REGEX = re.compile(r'(\d{14})')
+
+def datetime_to_ms(time):
+    return calendar.timegm(time.timetuple()) * 1000 + time.microsecond // 1000
+
+def ms_to_datetime(ms):
+    return datetime(1970, 1, 1) + timedelta(milliseconds=int(ms))
+
+# session directories are named after the host time when the session is created
+def get_session_time(sessionDir):
+    matched = SESSION_TIME_REGEX.search(os.path.basename(os.path.normpath(sessionDir)))
+    if matched:
+        try:
+            return datetime.strptime(matched.group(1), "%Y%m%d%H%M%S")
+        except ValueError:
+            pass
+    return dateutil.parser.parse(sessionDir, fuzzy=True)
+
+# decode the fixed width "MM-DD HH:MM:SS.mmm" logcat time prefix to epoch milliseconds without strptime
+# logcat doesn't log the year, the year is picked so the time is closest to the anchor time (the session time),
+# which keeps times after a new year rollover inside a session in order
+class LogcatTimeDecoder:
+    def __init__(self, anchorTime):
+        self.anchorMs = datetime_to_ms(anchorTime)
+        self.anchorYear = anchorTime.year
+        # time prefix up to seconds to epoch milliseconds
+        self.secondCache = {}
+
+    def decode(self, text):
+        prefix = text[:14]
+        secondMs = self.secondCache.get(prefix)
+        if secondMs is None:
+            secondMs = self.decode_second(int(prefix[0:2]), int(prefix[3:5]), int(prefix[6:8]), int(prefix[9:11]), int(prefix[12:14]))
+            self.secondCache[prefix] = secondMs
+        return secondMs + int(text[15:18])
+
+    # decode lines that may not start with a logcat time, returns None for those lines
+    def try_decode(self, text):
+        if isinstance(text, bytes):
+            text = text.decode("ascii", "replace")
+        if not LOGCAT_TIME_REGEX.match(text):
+            return None
+        return self.decode(text)
+
+    def decode_second(self, month, day, hour, minute, second):
+        candidates = [calendar.timegm((year, month, day, hour, minute, second, 0, 0, 0)) * 1000 for year in range(self.anchorYear - 1, self.anchorYear + 2)]
+        return min(candidates, key=lambda ms: abs(ms - self.anchorMs))
+
+    # vectorized decode of a whole column of time prefixes, returns an int64 array of epoch milliseconds
+    def decode_column(self, texts):
+        digits = np.array([text[:18] for text in texts], dtype='S18').view(np.uint8).reshape(-1, 18).astype(np.int64) - ord('0')
+        field = lambda i: digits[:, i] * 10 + digits[:, i + 1]
+        months = field(0) - 1
+        dayMs = (((field(3) - 1) * 24 + field(6)) * 60 + field(9)) * 60000 + field(12) * 1000 + digits[:, 15] * 100 + digits[:, 16] * 10 + digits[:, 17]
+        candidates = []
+        for year in range(self.anchorYear - 1, self.anchorYear + 2):
+            monthStart = ((year - 1970) * 12 + months).astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+            candidates.append(monthStart * 86400000 + dayMs)
+        candidates = np.stack(candidates)
+        closest = np.argmin(np.abs(candidates - self.anchorMs), axis=0)
+        return candidates[closest, np.arange(len(digits))]
+
+# map a log file read only for the with block, empty files can't be mapped and are given as empty bytes
+@contextmanager
+def map_file(fileName):
+    with open(fileName, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+# offset of the first line starting at or after pos
+def line_start(mm, pos):
+    if pos >= len(mm):
+        return len(mm)
+    if pos <= 0 or mm[pos - 1] == ord("\n"):
+        return pos
+    end = mm.find(b"\n", pos)
+    return len(mm) if end == -1 else end + 1
+
+# time of the first line at or after pos that has a logcat time prefix, and the offset after that line
+def next_logcat_time(mm, pos, decodeTime):
+    while pos < len(mm):
+        end = mm.find(b"\n", pos)
+        end = len(mm) if end == -1 else end
+        time = decodeTime(mm[pos:pos + 18])
+        if time is not None:
+            return time, end + 1
+        pos = end + 1
+    return None, len(mm)
+
+# binary search the time ordered logcat file for the offset of the first line logged at or after targetTime, or after it if afterTarget is set
+# only the timestamps visited by the search are decoded, lines without a time prefix are skipped over
+def seek_logcat_time(metricsFileName, targetTime, decodeTime, afterTarget = False):
+    with map_file(metricsFileName) as mm:
+        lo = 0
+        hi = len(mm)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            time, lineEnd = next_logcat_time(mm, line_start(mm, mid), decodeTime)
+            if time is not None and (time <= targetTime if afterTarget else time < targetTime):
+                lo = lineEnd
+            else:
+                hi = mid
+        return line_start(mm, lo)
+
+# the pil log has no timestamps per record, the first line is the adb time when the tool is started and each non-empty record is one second after the previous one
+# find the offset of the first record logged at or after startTime by scanning record separators, records before it are never decoded or parsed
+# returns the pil start time, the record offset and the number of records skipped
+def seek_pil_records(metricsFileName, line_splitter, startTime):
+    with map_file(metricsFileName) as mm:
+        headerEnd = mm.find(b"\n")
+        if headerEnd == -1:
+            headerEnd = len(mm)
+        # convert start time to datetime, exclide last three characters to convert nano seconds to micro seconds
+        pil_start_time = datetime.strptime(mm[:headerEnd].decode().strip()[:-3], "%Y%m%d%H%M%S%f")
+        if headerEnd == len(mm):
+            return pil_start_time, len(mm), 0
+
+        # windows line endings are translated when reading the log, leave these files to the record reader
+        if b"\r" in mm[:4096]:
+            return pil_start_time, headerEnd + 1, 0
+
+        separator = line_splitter.encode()
+        pos = headerEnd + 1
+        # the header line may end with the first record separator
+        if mm[headerEnd:headerEnd + len(separator)] == separator:
+            pos = headerEnd + len(separator)
+
+        skipCount = 0
+        while pil_start_time + timedelta(seconds=skipCount + 1) < startTime and pos < len(mm):
+            end = mm.find(separator, pos)
+            end = len(mm) if end == -1 else end
+            if end > pos:
+                skipCount += 1
+            pos = end + len(separator)
+        return pil_start_time, min(pos, len(mm)), skipCount
+
+##### automation events #####
+# events logged by the automation commands in the order the command queue runs them, the same in every session of a command queue
+# they anchor the alignment of the timelines of compared sessions, see alignutil.py
+AUTOMATION_EVENT_REGEX = re.compile(r'(Scene loaded, name: \S+|CommandScreenCapture \w+:\S+|Toggling feature \w+ to (?:True|False)|Feature status:.*\S|Reached destination .*\S|XRProfilingToolkit finished)')
+
+##### feature state timeline #####
+FEATURE_STATUS_TAG = "Feature status:"
+FEATURE_TOGGLE_REGEX = re.compile(r'CommandToggleFeature Toggling feature (\w+) to (True|False)')
+# CommandToggleFeature waits this long after toggling, feature status lines logged this close to a toggle command belong to it
+FEATURE_TOGGLE_WINDOW_MS = 1000
+
+# feature name to on/off from a "Feature status:FFR:True, MSAA:False, AdaptiveResolution:False" line
+def parse_feature_status(line):
+    status = {}
+    for item in line.split(FEATURE_STATUS_TAG, 1)[1].split(","):
+        name, _, value = item.strip().rpartition(":")
+        if name:
+            status[name] = value.strip() == "True"
+    return status
+
+# intervals of the session with the same feature states, segment i covers [starts[i], starts[i + 1]) seconds since the session start
+# states holds the on/off state of each feature per segment, None when the state of a feature is unknown
+class FeatureTimeline:
+    def __init__(self, features, starts, states, duration):
+        self.features = list(features)
+        self.starts = np.asarray(starts, dtype=np.float64)
+        self.states = [tuple(state) for state in states]
+        self.duration = duration
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def ends(self):
+        return np.append(self.starts[1:], self.duration)
+
+    # segment of each timestamp, timestamps before the first segment are assigned to it
+    def segment_indices(self, timestamps):
+        return np.maximum(np.searchsorted(self.starts, np.asarray(timestamps, dtype=np.float64), side='right') - 1, 0)
+
+    # distinct feature states in the order they first appear
+    def combinations(self):
+        return list(dict.fromkeys(self.states))
+
+    def get_label(self, state):
+        return ", ".join(f"{feature}:{'Unknown' if on is None else 'On' if on else 'Off'}" for feature, on in zip(self.features, state))
+
+    # same encoding as the feature flags of the screen capture file names
+    def get_flags(self, state):
+        return "".join("x" if on is None else "1" if on else "0" for on in state)
+
+    # segments listed in the report data
+    def get_segments(self):
+        return [{'start': start, 'end': end, 'features': self.get_label(state), 'flags': self.get_flags(state)} for start, end, state in zip(self.starts.tolist(), self.ends.tolist(), self.states)]
+
+    def to_json(self):
+        return {'features': self.features, 'starts': self.starts.tolist(), 'states': [list(state) for state in self.states], 'duration': self.duration}
+
+    @staticmethod
+    def from_json(data):
+        return FeatureTimeline(data['features'], data['starts'], data['states'], data['duration'])
+
+# segment the session by feature state. Toggle commands and feature status changes without a toggle command start a new segment,
+# the state of a segment is the last feature status logged before it ends. Status lines logged close to a toggle command are moved to the command
+# so the order of the toggle and status lines doesn't matter. Times are in epoch milliseconds
+def build_feature_timeline(statusEvents, toggleTimes, start_ms, finish_ms):
+    features = []
+    for time, status in statusEvents:
+        features.extend(name for name in status if name not in features)
+    states = [tuple(status.get(name) for name in features) for time, status in statusEvents]
+
+    toggleTimes = np.unique(np.asarray(toggleTimes, dtype=np.int64))
+    statusTimes = np.asarray([time for time, status in statusEvents], dtype=np.int64)
+    if len(toggleTimes) and len(statusTimes):
+        # nearest toggle command of each status line
+        after = np.clip(np.searchsorted(toggleTimes, statusTimes), 0, len(toggleTimes) - 1)
+        before = np.maximum(after - 1, 0)
+        nearest = np.where(np.abs(toggleTimes[before] - statusTimes) < np.abs(toggleTimes[after] - statusTimes), toggleTimes[before], toggleTimes[after])
+        statusTimes = np.where(np.abs(nearest - statusTimes) <= FEATURE_TOGGLE_WINDOW_MS, nearest, statusTimes)
+    order = np.argsort(statusTimes, kind='stable')
+    statusTimes = statusTimes[order]
+    states = [states[i] for i in order]
+
+    boundaries = set(toggleTimes.tolist())
+    for i in range(1, len(states)):
+        if states[i] != states[i - 1]:
+            boundaries.add(int(statusTimes[i]))
+    starts = [start_ms] + sorted(time for time in boundaries if start_ms < time < finish_ms)
+    ends = starts[1:] + [finish_ms]
+    last = np.searchsorted(statusTimes, ends, side='left') - 1
+    segmentStates = [states[i] if i >= 0 else (None,) * len(features) for i in last.tolist()]
+
+    # merge consecutive segments with the same states, like a feature toggled to its current state
+    mergedStarts = []
+    mergedStates = []
+    for start, state in zip(starts, segmentStates):
+        if not mergedStates or mergedStates[-1] != state:
+            mergedStarts.append((start - start_ms) / 1000)
+            mergedStates.append(state)
+    return FeatureTimeline(features, mergedStarts, mergedStates, (finish_ms - start_ms) / 1000)
+
+# generate metrics data for the given session, the parsed data is cached in the session directory and reused while the logs and schemas are unchanged
+# metrics is an optional list of metrics to parse, see MetricsSchema. All enabled metrics are parsed if it is None
+# returns the automation id, the metrics data, the start and finish time, the feature timeline and the automation events of the session
+def get_metrics_data(sessionDir, useCache = True, workers = None, metrics = None):
+    return get_sessions_metrics_data([sessionDir], useCache, workers, metrics)[0]
+
+# metrics data of several sessions, see get_metrics_data. The sessions without a valid cache are parsed together
+def get_sessions_metrics_data(sessionDirs, useCache = True, workers = None, metrics = None):
+    if not useCache:
+        return parse_sessions_metrics_data(sessionDirs, workers, metrics)
+
+    results = [None] * len(sessionDirs)
+    caches = {}
+    for i, sessionDir in enumerate(sessionDirs):
+        cacheDir = get_session_cache_dir(sessionDir, metrics)
+        cacheKey = get_session_cache_key(sessionDir, metrics)
+        results[i] = load_session_cache(cacheDir, cacheKey)
+        if results[i] is None:
+            caches[i] = (cacheDir, cacheKey)
+
+    parsed = parse_sessions_metrics_data([sessionDirs[i] for i in caches], workers, metrics) if caches else []
+    for i, result in zip(caches, parsed):
+        save_session_cache(caches[i][0], caches[i][1], result)
+        results[i] = result
+    return results
 
-    ##### handle adb performance metrics #####
-    metricsFileName = glob.glob(os.path.join(sessionDir, '*_metrics.log'))[0]
-    metricsSchemaPath = glob.glob(os.path.join(sessionDir, '*_metrics.schema'))[0]
-    # load metrics data schema
-    metricsSchema, metricsDesc, metric_splitter, key_val_separator, metricsLines = load_metrics_with_schema(metricsFileName, metricsSchemaPath)
+# logs smaller than this are parsed in the calling process, starting worker processes costs more than it saves
+PARALLEL_PARSE_MIN_BYTES = 16 << 20
+# sessions parsed at once that are parsed by worker processes however small their logs, each log of each session is one job
+PARALLEL_PARSE_MIN_SESSIONS = 2
+# smallest byte range handed to a worker process
+PARALLEL_CHUNK_MIN_BYTES = 4 << 20
 
-    timeStamps = []
+# size of the byte ranges the parse window is split into, the whole window is one range if it is not worth parsing in parallel
+def get_chunk_size(windowSize, workers):
+    if workers <= 1 or windowSize < PARALLEL_PARSE_MIN_BYTES:
+        return max(windowSize, 1)
+    # a few ranges per worker so a slow range does not leave the other workers idle
+    return max(PARALLEL_CHUNK_MIN_BYTES, -(-windowSize // (workers * 4)))
+
+# split [startOffset, endOffset) of a logcat file into line aligned byte ranges
+def split_logcat_ranges(metricsFileName, startOffset, endOffset, chunkSize):
+    with map_file(metricsFileName) as mm:
+        ranges = []
+        pos = startOffset
+        while pos < endOffset:
+            end = min(line_start(mm, pos + chunkSize), endOffset)
+            ranges.append((pos, end))
+            pos = end
+        return ranges
+
+# split the pil records after startOffset into record aligned byte ranges, at most maxRecords non-empty records are included
+# returns (start offset, end offset, number of non-empty records before the range) for each range
+def split_pil_ranges(metricsFileName, line_splitter, startOffset, maxRecords, chunkSize):
+    with map_file(metricsFileName) as mm:
+        separator = line_splitter.encode()
+        ranges = []
+        rangeStart = startOffset
+        rangeRecords = 0
+        count = 0
+        pos = startOffset
+        while pos < len(mm) and count < maxRecords:
+            end = mm.find(separator, pos)
+            end = len(mm) if end == -1 else end
+            if end > pos:
+                count += 1
+            pos = min(end + len(separator), len(mm))
+            if pos - rangeStart >= chunkSize:
+                ranges.append((rangeStart, pos, rangeRecords))
+                rangeStart = pos
+                rangeRecords = count
+        if pos > rangeStart:
+            ranges.append((rangeStart, pos, rangeRecords))
+        return ranges
+
+# run each (func, args) job, in a shared pool of worker processes if there is more than one job. Results are returned in order
+def run_parse_jobs(jobs, workers):
+    if len(jobs) <= 1 or workers <= 1:
+        return [func(*args) for func, args in jobs]
+    with ProcessPoolExecutor(min(workers, len(jobs))) as executor:
+        futures = [executor.submit(func, *args) for func, args in jobs]
+        return [future.result() for future in futures]
+
+# merge the per range results in log order, metrics keep the order they first appear in
+def merge_parse_chunks(chunks):
+    timeStamps = ColumnBuffer()
+    metricsData = {}
+    for chunkTimestamps, chunkData in chunks:
+        timeStamps.extend(chunkTimestamps)
+        for mKey in chunkData:
+            if mKey not in metricsData:
+                metricsData[mKey] = chunkData[mKey]
+            else:
+                metricsData[mKey].merge(chunkData[mKey])
+    return timeStamps.view(), metricsData
+
+# parse the logcat lines in [startOffset, endOffset) of an adb metrics log, runs in a worker process for large logs
+def parse_logcat_chunk(metricsFileName, metricsSchemaPath, selectedMetrics, startOffset, endOffset, anchorTime, start_ms, finish_ms):
+    timeDecoder = LogcatTimeDecoder(anchorTime)
+    metricsSchema, metricsLines = load_metrics_with_schema(metricsFileName, metricsSchemaPath, startOffset, endOffset, selectedMetrics)
+    metric_splitter = metricsSchema.metric_splitter
+
+    timeStamps = ColumnBuffer()
     metricsData = {}
 
     for line in metricsLines:  
         if not line or line.startswith("---------"):
             continue
-        time_str = line[0:18]
-        time = datetime.strptime(f"{current_year} {time_str}", f"%Y {adb_timestamp_format}")
-        if time > finish_time:
+        time = timeDecoder.decode(line)
+        if time > finish_ms:
             break
-        if time < start_time:
+        if time < start_ms:
             continue
 
-        duration = time - start_time
-        
-        timeStamps.append(duration)
+        timeStamps.append((time - start_ms) / 1000)
         dataStr = line[18:].split(":")[1].strip()
         dataEntries = dataStr.split(metric_splitter)
         for i in range(len(dataEntries)):
@@ -92,17 +560,8 @@ def get_metrics_data(sessionDir):
                 
         # remove empty entry
         dataEntries = [i for i in dataEntries if i]
-        parsedMetrics, parsedDesc = parse_metrics(metricsSchema, metricsDesc, dataEntries, key_val_separator)
-        lineData = {}
-        for metric in parsedMetrics:
-            if "ignore" in metric:
-                continue
-            tags = metric.split(".", 1)
-            name = tags[0] 
-            type = tags[1]
-            if lineData.get(name) == None:
-                lineData[name] = []
-            lineData[name].append((metric, parsedMetrics[metric]))
+        parsedMetrics = parse_metrics(metricsSchema, dataEntries)
+        lineData = group_metrics(metricsSchema, parsedMetrics)
         
         for mKey in lineData:
             if mKey not in metricsData.keys():
@@ -110,36 +569,19 @@ def get_metrics_data(sessionDir):
             
             metricsData[mKey].append(lineData[mKey])
 
-        # add description to metrics data
-        # TODO(xutong.zhou): do it only once, not every metrics line
-        for pd in parsedDesc:
-            mName = pd.split('.')[0]
-            if mName in metricsData:
-                metricsData[mName].add_description(pd, parsedDesc[pd]) 
-
-    # this is for adb metrics only
-    x_seconds = [time.total_seconds() for time in timeStamps]
+    return timeStamps.view(), metricsData
 
-    for md in metricsData:
-        metricsData[md].add_timestamps(x_seconds)
+# parse the pil records in [startOffset, endOffset), time is the time of the record before the range
+def parse_pil_chunk(metricsFileName, metricsSchemaPath, selectedMetrics, startOffset, endOffset, time, start_time, finish_time):
+    metricsSchema, metricsLines = load_metrics_with_schema(metricsFileName, metricsSchemaPath, startOffset, endOffset, selectedMetrics)
+    metric_splitter = metricsSchema.metric_splitter
 
-    ##### handle pil tools output #####
-    metricsFileName = os.path.join(sessionDir, 'pil_output.log')
-    #metricsSchemaPath = os.path.splitext(os.path.basename(metricsFileName))[0] + ".schema"
-    metricsSchemaPath = os.path.join(sessionDir, 'pil_output.schema')
+    timeStamps = ColumnBuffer()
+    metricsData = {}
 
-    # load metrics data schema
-    metricsSchema, metricsDesc, metric_splitter, key_val_separator, metricsLines = load_metrics_with_schema(metricsFileName, metricsSchemaPath)
-    # convert start time to datetime, exclide last three characters to convert nano seconds to micro seconds
-    pil_start_time = datetime.strptime(metricsLines[0].split('\n', 1)[0][:-3], "%Y%m%d%H%M%S%f")
-    metricsLines[0] = metricsLines[0].split('\n', 1)[1]
-    time = pil_start_time
-    timeStamps = []
-    pil_metrics = []
     for line in metricsLines:
         if not line:
             continue
-        lineData = {}
         time = time + timedelta(seconds=1)
         if time > finish_time:
             break
@@ -147,60 +589,331 @@ def get_metrics_data(sessionDir):
             continue
         
         duration = time - start_time
-        timeStamps.append(duration)
+        timeStamps.append(duration.total_seconds())
         dataEntries = line.split(metric_splitter)
         
-        parsedMetrics, parsedDesc = parse_metrics(metricsSchema, metricsDesc, dataEntries, key_val_separator)
-        for metric in parsedMetrics:
-            tags = metric.split(".", 1)
-            name = tags[0] 
-            type = tags[1]
-            if lineData.get(name) == None:
-                lineData[name] = []
-            lineData[name].append((metric, parsedMetrics[metric]))
+        parsedMetrics = parse_metrics(metricsSchema, dataEntries)
+        lineData = group_metrics(metricsSchema, parsedMetrics)
         
         for mKey in lineData:
             if mKey not in metricsData.keys():
                 metricsData[mKey] = create_metrics(lineData[mKey])
-                pil_metrics.append(mKey)
             
             metricsData[mKey].append(lineData[mKey])
 
+    return timeStamps.view(), metricsData
+
+##### metrics sources #####
+# a metrics source is one log of the session. seek() finds the part of the log inside the automation time window and returns its size in bytes,
+# split() cuts it into parse jobs and merge() builds the metrics data from the job results. Jobs of all sources run in the same worker pool
+class AdbMetricsSource:
+    def __init__(self, sessionDir, anchorTime, start_ms, finish_ms, selectedMetrics):
+        self.metricsFileName = glob.glob(os.path.join(sessionDir, '*_metrics.log'))[0]
+        self.metricsSchemaPath = glob.glob(os.path.join(sessionDir, '*_metrics.schema'))[0]
+        self.selectedMetrics = selectedMetrics
+        self.anchorTime = anchorTime
+        self.start_ms = start_ms
+        self.finish_ms = finish_ms
+
+    def seek(self):
+        timeDecoder = LogcatTimeDecoder(self.anchorTime)
+        # only the lines logged while the automation runs are parsed, find them without parsing the rest of the log
+        self.startOffset = seek_logcat_time(self.metricsFileName, self.start_ms, timeDecoder.try_decode)
+        self.endOffset = seek_logcat_time(self.metricsFileName, self.finish_ms, timeDecoder.try_decode, afterTarget=True)
+        return self.endOffset - self.startOffset
+
+    def split(self, chunkSize):
+        ranges = split_logcat_ranges(self.metricsFileName, self.startOffset, self.endOffset, chunkSize)
+        return [(parse_logcat_chunk, (self.metricsFileName, self.metricsSchemaPath, self.selectedMetrics, start, end, self.anchorTime, self.start_ms, self.finish_ms)) for start, end in ranges]
+
+    def merge(self, chunks):
+        timestamps, metricsData = merge_parse_chunks(chunks)
         # add description to metrics data
-        # TODO(xutong.zhou): do it only once, not every metrics line
-        for pd in parsedDesc:
-            mName = pd.split('.')[0]
-            if mName in metricsData:
-                metricsData[mName].add_description(pd, parsedDesc[pd])
+        load_metrics_schema(self.metricsSchemaPath, self.selectedMetrics).add_descriptions(metricsData)
+        # all metrics of the log share the same timestamps column
+        for mKey in metricsData:
+            metricsData[mKey].add_timestamps(timestamps)
+        return metricsData
 
-    pil_time_seconds = [time.total_seconds() for time in timeStamps]
+class PilMetricsSource:
+    def __init__(self, sessionDir, anchorTime, start_ms, finish_ms, selectedMetrics):
+        self.metricsFileName = os.path.join(sessionDir, 'pil_output.log')
+        self.metricsSchemaPath = os.path.join(sessionDir, 'pil_output.schema')
+        self.selectedMetrics = selectedMetrics
+        self.metricsSchema = load_metrics_schema(self.metricsSchemaPath, selectedMetrics)
+        self.start_time = ms_to_datetime(start_ms)
+        self.finish_time = ms_to_datetime(finish_ms)
 
-    for mKey in pil_metrics:
-        metricsData[mKey].add_timestamps(pil_time_seconds)
+    def seek(self):
+        # skip the records logged before the automation starts without parsing them
+        pil_start_time, self.startOffset, skipCount = seek_pil_records(self.metricsFileName, self.metricsSchema.line_splitter, self.start_time)
+        self.time = pil_start_time + timedelta(seconds=skipCount)
+        return os.path.getsize(self.metricsFileName) - self.startOffset
 
-    return automationId, metricsData,start_time,finish_time
+    def split(self, chunkSize):
+        # records after the automation finishes are not parsed
+        maxRecords = max((self.finish_time - self.time) // timedelta(seconds=1), 0)
+        ranges = split_pil_ranges(self.metricsFileName, self.metricsSchema.line_splitter, self.startOffset, maxRecords, chunkSize)
+        return [(parse_pil_chunk, (self.metricsFileName, self.metricsSchemaPath, self.selectedMetrics, start, end, self.time + timedelta(seconds=count), self.start_time, self.finish_time)) for start, end, count in ranges]
 
-def load_metrics_with_schema(metricsFileName, metricsSchemaPath):
-    fMetrics = open(metricsFileName, "r")
-    fMetricsSchema = open(metricsSchemaPath, "r")
-    
-    metricsSchemaJson = json.loads(fMetricsSchema.read())
+    def merge(self, chunks):
+        timestamps, metricsData = merge_parse_chunks(chunks)
+        self.metricsSchema.add_descriptions(metricsData)
+        for mKey in metricsData:
+            metricsData[mKey].add_timestamps(timestamps)
+        return metricsData
 
-    metric_splitter = metricsSchemaJson['metric_splitter']
-    key_val_separator = metricsSchemaJson['key_val_separator']
-    metric_line_splitter = metricsSchemaJson["line_splitter"]
-    metricsSchema={}
-    metricsDesc={}
+# sources are merged in this order, a metric already provided by an earlier source is not replaced
+METRICS_SOURCES = [AdbMetricsSource, PilMetricsSource]
 
-    for metric in metricsSchemaJson['metrics']:
-        if metric['enabled'] == 0:
-            continue
-        metricsSchema[metric['name']] = metric['template']
-        if 'description' in metric:
-            metricsDesc[metric['name']] = metric['description']
+# read the start time, finish time, automation id and feature timeline of a session from the xrprofilingtoolkit log
+def parse_session_log(sessionDir, timeDecoder):
+    with open(os.path.join(sessionDir, "xr_profilingtoolkit.log"), "r") as fXRProfilingToolkitLog:
+        logLines = [line for line in fXRProfilingToolkitLog if line.strip()]
+    logTimes = timeDecoder.decode_column(logLines)
+
+    automationId = ""
+    featureStatusEvents = []
+    featureToggleTimes = []
+    automationEvents = []
+
+    for line, time in zip(logLines, logTimes.tolist()):
+        if "starting" in line:
+            start_ms = time
+            automationId = line.split(":")[-1].strip()
+        if "finished" in line:
+            finish_ms = time
+        if FEATURE_STATUS_TAG in line:
+            featureStatusEvents.append((time, parse_feature_status(line)))
+        if FEATURE_TOGGLE_REGEX.search(line):
+            featureToggleTimes.append(time)
+        eventMatch = AUTOMATION_EVENT_REGEX.search(line)
+        if eventMatch:
+            automationEvents.append((time, eventMatch.group(1)))
+    featureTimeline = build_feature_timeline(featureStatusEvents, featureToggleTimes, start_ms, finish_ms)
+    # event times are in seconds since the automation started, like the metrics timestamps
+    automationEvents = [[(time - start_ms) / 1000, event] for time, event in automationEvents if time >= start_ms]
+    return automationId, start_ms, finish_ms, featureTimeline, automationEvents
+
+# parse metrics data for the given session from the logs
+# the logs are split into byte ranges, large sessions are parsed in worker processes. workers defaults to the number of cpus
+def parse_metrics_data(sessionDir, workers = None, metrics = None):
+    return parse_sessions_metrics_data([sessionDir], workers, metrics)[0]
+
+# parse metrics data for several sessions, the byte ranges of all sessions are parsed by one pool of worker processes
+# the pool is used for large logs, several sessions or when the number of workers is given. Returns the result of parse_metrics_data for each session
+def parse_sessions_metrics_data(sessionDirs, workers = None, metrics = None):
+    explicitWorkers = workers is not None
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    sessions = []
+    for sessionDir in sessionDirs:
+        anchorTime = get_session_time(sessionDir)
+        automationId, start_ms, finish_ms, featureTimeline, automationEvents = parse_session_log(sessionDir, LogcatTimeDecoder(anchorTime))
+        sources = [source(sessionDir, anchorTime, start_ms, finish_ms, metrics) for source in METRICS_SOURCES]
+        sessions.append((automationId, start_ms, finish_ms, featureTimeline, automationEvents, sources))
+
+    ##### parse all metrics sources of all sessions concurrently #####
+    # small sessions are worth parsing in parallel when there are several of them
+    windowSize = sum(source.seek() for session in sessions for source in session[-1])
+    if windowSize < PARALLEL_PARSE_MIN_BYTES and len(sessions) < PARALLEL_PARSE_MIN_SESSIONS and not explicitWorkers:
+        workers = 1
+    chunkSize = get_chunk_size(windowSize, workers)
+    sourceJobs = [source.split(chunkSize) for session in sessions for source in session[-1]]
+    results = run_parse_jobs([job for jobs in sourceJobs for job in jobs], workers)
+
+    parsed = []
+    sourceJobs = iter(sourceJobs)
+    for automationId, start_ms, finish_ms, featureTimeline, automationEvents, sources in sessions:
+        metricsData = {}
+        for source in sources:
+            jobs = next(sourceJobs)
+            sourceData = source.merge(results[:len(jobs)])
+            results = results[len(jobs):]
+            for mKey in sourceData:
+                if mKey not in metricsData:
+                    metricsData[mKey] = sourceData[mKey]
+        parsed.append((automationId, metricsData, ms_to_datetime(start_ms), ms_to_datetime(finish_ms), featureTimeline, automationEvents))
+    return parsed
+
+# raw reader over [startOffset, endOffset) of a file, reads to the end of the file if endOffset is None
+class FileRange(io.RawIOBase):
+    def __init__(self, fileName, startOffset = 0, endOffset = None):
+        self.file = open(fileName, "rb")
+        self.file.seek(startOffset)
+        self.remaining = None if endOffset is None else max(endOffset - startOffset, 0)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = len(buffer) if self.remaining is None else min(len(buffer), self.remaining)
+        data = self.file.read(size)
+        buffer[:len(data)] = data
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+# read metrics records from a log file one at a time, records are split the same way as str.split but only one buffered chunk is kept in memory
+def read_metrics_records(metricsFileName, line_splitter, startOffset = 0, endOffset = None, chunkSize = 1 << 20):
+    fRaw = io.BufferedReader(FileRange(metricsFileName, startOffset, endOffset))
+    with io.TextIOWrapper(fRaw) as fMetrics:
+        pending = ""
+        while True:
+            chunk = fMetrics.read(chunkSize)
+            if not chunk:
+                break
+            records = (pending + chunk).split(line_splitter)
+            # last record may continue in the next chunk
+            pending = records.pop()
+            for record in records:
+                yield record
+        yield pending
+
+##### parsed session cache #####
+SESSION_CACHE_DIR = ".xrprof_cache"
+# bump when the parsed data layout changes to invalidate existing caches
+SESSION_CACHE_VERSION = 3
+
+# sessions parsed with a metrics selection are cached next to the full parse instead of replacing it
+def get_session_cache_dir(sessionDir, metrics = None):
+    cacheDir = os.path.join(sessionDir, SESSION_CACHE_DIR)
+    if metrics is None:
+        return cacheDir
+    selection = "|".join(sorted({name.strip().casefold() for name in metrics}))
+    return os.path.join(cacheDir, "metrics_" + hashlib.sha1(selection.encode()).hexdigest()[:12])
+
+# small files are hashed by content, large metrics logs by name, size and modification time so a warm cache is checked without reading them
+def get_session_cache_key(sessionDir, metrics = None):
+    keyHash = hashlib.sha1(f"version:{SESSION_CACHE_VERSION}".encode())
+    if metrics is not None:
+        keyHash.update(("metrics:" + "|".join(sorted({name.strip().casefold() for name in metrics}))).encode())
+    logFiles = sorted(glob.glob(os.path.join(sessionDir, '*.log')))
+    schemaFiles = sorted(glob.glob(os.path.join(sessionDir, '*.schema')))
+    for fileName in logFiles + schemaFiles:
+        stat = os.stat(fileName)
+        keyHash.update(f"{os.path.basename(fileName)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        if fileName in schemaFiles or os.path.basename(fileName) == "xr_profilingtoolkit.log":
+            with open(fileName, "rb") as f:
+                keyHash.update(f.read())
+    return keyHash.hexdigest()
+
+def save_metrics_columns(metrics, name, cacheDir, columns):
+    entry = {'type': type(metrics).__name__, 'description': getattr(metrics, 'description', None)}
+    if isinstance(metrics, MetricsValueSet):
+        entry['valset'] = {mKey: save_metrics_columns(metrics.valset[mKey], f"{name}.{mKey}", cacheDir, columns) for mKey in metrics.valset}
+        return entry
+
+    if isinstance(metrics, MetricsValue):
+        entry.update({'unit': metrics.unit, 'maxValue': metrics.maxValue, 'maxValueUnit': metrics.maxValueUnit})
+        values = metrics.val
+    else:
+        values = np.array(metrics.val, dtype=str)
+    entry['val'] = f"{name}.val.npy"
+    np.save(os.path.join(cacheDir, entry['val']), values)
+    # metrics from the same log share their timestamps column, save it once
+    timestamps = np.asarray(metrics.timestamps, dtype=np.float64)
+    columnKey = (timestamps.__array_interface__['data'][0], len(timestamps))
+    if columnKey not in columns:
+        columns[columnKey] = f"timestamps_{len(columns)}.npy"
+        np.save(os.path.join(cacheDir, columns[columnKey]), timestamps)
+    entry['timestamps'] = columns[columnKey]
+    return entry
+
+def load_metrics_columns(entry, cacheDir, columns):
+    if entry['type'] == "MetricsValueSet":
+        metrics = MetricsValueSet([])
+        metrics.valset = {mKey: load_metrics_columns(entry['valset'][mKey], cacheDir, columns) for mKey in entry['valset']}
+    else:
+        if entry['type'] == "MetricsValue":
+            metrics = MetricsValue(entry['unit'], entry['maxValue'], entry['maxValueUnit'])
+            metrics.values = ColumnBuffer.wrap(np.load(os.path.join(cacheDir, entry['val']), mmap_mode='r'))
+        else:
+            metrics = MetricsStatus() if entry['type'] == "MetricsStatus" else MetricsStringValue()
+            metrics.val = np.load(os.path.join(cacheDir, entry['val'])).tolist()
+        if entry['timestamps'] not in columns:
+            columns[entry['timestamps']] = np.load(os.path.join(cacheDir, entry['timestamps']), mmap_mode='r')
+        metrics.timestamps = columns[entry['timestamps']]
+    if entry['description'] is not None:
+        metrics.description = entry['description']
+    return metrics
+
+def save_session_cache(cacheDir, cacheKey, result):
+    automationId, metricsData, start_time, finish_time, featureTimeline, automationEvents = result
+    manifestPath = os.path.join(cacheDir, "manifest.json")
+    try:
+        os.makedirs(cacheDir, exist_ok=True)
+        # remove the manifest first so a partially written cache is never loaded
+        if os.path.exists(manifestPath):
+            os.remove(manifestPath)
+        for fileName in glob.glob(os.path.join(cacheDir, '*.npy')):
+            os.remove(fileName)
+        columns = {}
+        manifest = {
+            'key': cacheKey,
+            'automationId': automationId,
+            'start_time': start_time.isoformat(),
+            'finish_time': finish_time.isoformat(),
+            'featureTimeline': featureTimeline.to_json(),
+            'automationEvents': automationEvents,
+            'metrics': {name: save_metrics_columns(metricsData[name], name, cacheDir, columns) for name in metricsData},
+        }
+        with open(manifestPath, "w") as fManifest:
+            json.dump(manifest, fManifest)
+    except OSError as e:
+        print(f"Failed to write session cache to {cacheDir}: {e}")
+
+# load the parsed session from the cache, columns are memory mapped. Returns None if there is no valid cache
+def load_session_cache(cacheDir, cacheKey):
+    try:
+        with open(os.path.join(cacheDir, "manifest.json"), "r") as fManifest:
+            manifest = json.load(fManifest)
+        if manifest['key'] != cacheKey:
+            return None
+        columns = {}
+        metricsData = {name: load_metrics_columns(manifest['metrics'][name], cacheDir, columns) for name in manifest['metrics']}
+        featureTimeline = FeatureTimeline.from_json(manifest['featureTimeline'])
+    except (OSError, ValueError, KeyError):
+        return None
+    return manifest['automationId'], metricsData, datetime.fromisoformat(manifest['start_time']), datetime.fromisoformat(manifest['finish_time']), featureTimeline, manifest['automationEvents']
+
+# device specification of a session from its device_spec.log, the serial number is left out of reports unless asked for
+def read_device_spec(session_dir, includeSerial = False):
+    DevicesessionData = {}
+    with open(os.path.join(session_dir, "device_spec.log"), 'r') as fDeviceSpec:
+        deviceSpecs = fDeviceSpec.readlines()
+    for specLine in deviceSpecs:
+        if 'OS version' in specLine:
+            specLinesplit = specLine.split(':', 1)
+            DevicesessionData['OS version'] = specLinesplit[1].replace('\n', '')
+        if 'Device name' in specLine:
+            specLinesplit = specLine.split(',', 1)
+            subspecLinesplit1 = specLinesplit[0].split(':', 1)
+            DevicesessionData['Device name'] = subspecLinesplit1[1].replace('\n', '')
+            subspecLinesplit2 = specLinesplit[1].split(':', 1)
+            DevicesessionData['Model'] = subspecLinesplit2[1].replace('\n', '')
+        if 'Default eye buffer size' in specLine:
+            specLinesplit = specLine.split(':', 1)
+            DevicesessionData['Default eye buffer size'] = specLinesplit[1].replace('\n', '')
+        if includeSerial and 'Device serial number' in specLine:
+            specLinesplit = specLine.split(':', 1)
+            DevicesessionData['Device serial number'] = specLinesplit[1].replace('\n', '')
+    return DevicesessionData
+
+def load_metrics_schema(metricsSchemaPath, selectedMetrics = None):
+    with open(metricsSchemaPath, "r") as fMetricsSchema:
+        return MetricsSchema(json.loads(fMetricsSchema.read()), selectedMetrics)
+
+def load_metrics_with_schema(metricsFileName, metricsSchemaPath, startOffset = 0, endOffset = None, selectedMetrics = None):
+    metricsSchema = load_metrics_schema(metricsSchemaPath, selectedMetrics)
     
-    metricLines = fMetrics.read().split(metric_line_splitter)
-    return metricsSchema, metricsDesc, metric_splitter, key_val_separator, metricLines
+    metricLines = read_metrics_records(metricsFileName, metricsSchema.line_splitter, startOffset, endOffset)
+    return metricsSchema, metricLines
 
 def create_metrics(metricsData):
     metrics = None
@@ -224,18 +937,23 @@ def create_metrics(metricsData):
     
 class MetricsValue:
     def __init__(self, unit = None, maxValue = None, maxValueUnit = None):
-        self.val = []
+        self.values = ColumnBuffer()
         self.unit = unit
         self.maxValue = maxValue
         self.maxValueUnit = maxValueUnit
         self.description = ""
-        self.timestamps = []
+        self.timestamps = np.empty(0)
+
+    # values parsed so far as a float64 array, this is a view into the column buffer
+    @property
+    def val(self):
+        return self.values.view()
     
     def append(self, data):
         for entry in data:
             tag = entry[0].split(".")[-1]
             if tag == "value":
-                self.val.append(entry[1])
+                self.values.append(entry[1])
             elif tag == "unit":
                 self.unit = entry[1]
             elif tag == "maxValue":
@@ -245,17 +963,21 @@ class MetricsValue:
     
     def add_description(self, name, description):
         self.description = description
+
+    # append the values parsed from a later part of the log
+    def merge(self, other):
+        self.values.extend(other.val)
+        for attr in ("unit", "maxValue", "maxValueUnit"):
+            if getattr(other, attr) is not None:
+                setattr(self, attr, getattr(other, attr))
     
     def average(self):
         assert(len(self.val) == len(self.timestamps))
-        total = 0
-        for i in range(0, len(self.val)):
-            duration = self.timestamps[i] if i == 0 else self.timestamps[i] - self.timestamps[i - 1]
-            total += duration * self.val[i]
-        return total / self.timestamps[-1]
+        # weight each value by the time elapsed since the previous sample
+        return weighted_mean(self.timestamps, self.val)
     
     def add_timestamps(self, timestamps):
-        self.timestamps = timestamps           
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
 
 class MetricsStatus:
     def __init__(self):
@@ -271,6 +993,9 @@ class MetricsStatus:
             tag = entry[0].split(".")[-1]
             if tag == "status":
                 self.val.append(entry[1])
+
+    def merge(self, other):
+        self.val.extend(other.val)
     
     def add_timestamps(self, timestamps):
         self.timestamps = timestamps
@@ -289,6 +1014,9 @@ class MetricsStringValue:
             tag = entry[0].split(".")[-1]
             if tag == "stringValue":
                 self.status.append(entry[1])
+
+    def merge(self, other):
+        self.val.extend(other.val)
                 
     def add_timestamps(self, timestamps):
         self.timestamps = timestamps   
@@ -310,6 +1038,13 @@ class MetricsValueSet:
             dataset[tags[1]].append((tags[-1], entry[1]))
         for mKey in dataset:
             self.valset[mKey].append(dataset[mKey])
+
+    def merge(self, other):
+        for mKey in other.valset:
+            if mKey in self.valset:
+                self.valset[mKey].merge(other.valset[mKey])
+            else:
+                self.valset[mKey] = other.valset[mKey]
     
     # name to look up for sub metrics value
     def add_description(self, name, description):
@@ -326,4 +1061,36 @@ class MetricsValueSet:
 
     def add_timestamps(self, timestamps):
         for mKey in self.valset:
-            self.valset[mKey].add_timestamps(timestamps)  
\ No newline at end of file
+            self.valset[mKey].add_timestamps(timestamps)
+
+# numeric metrics columns by name, the values of metrics value sets are named after the set and the value (like FrameTime.GPU)
+def get_value_columns(metricsData):
+    columns = {}
+    for name, metrics in metricsData.items():
+        if isinstance(metrics, MetricsValueSet):
+            for mKey, value in metrics.valset.items():
+                columns[f"{name}.{mKey}"] = value
+        elif isinstance(metrics, MetricsValue):
+            columns[name] = metrics
+    return columns
+
+# names of the metrics parsed from the gpu profiler (PIL) log of a session
+def get_pil_metrics_names(sessionDir, metrics = None):
+    metricsSchemaPath = os.path.join(sessionDir, 'pil_output.schema')
+    if not os.path.exists(metricsSchemaPath):
+        return set()
+    return set(load_metrics_schema(metricsSchemaPath, metrics).metricNames.values())
+
+# value column (see get_value_columns) of each schema metric name of a session, like FrmGpu to FrameTime.GPU. Names are casefolded
+# the names come from the metrics schema of the session the metrics log is parsed with (pxr or ovr) and the gpu profiler schema
+def get_schema_columns(sessionDir):
+    schemaColumns = {}
+    metricsSchemaPaths = glob.glob(os.path.join(sessionDir, '*_metrics.schema'))[:1] + [os.path.join(sessionDir, 'pil_output.schema')]
+    for metricsSchemaPath in metricsSchemaPaths:
+        if not os.path.exists(metricsSchemaPath):
+            continue
+        for name, template in load_metrics_schema(metricsSchemaPath).templates.items():
+            for field in template.fields:
+                if field.endswith(".value"):
+                    schemaColumns[name.casefold()] = field.rsplit(".", 1)[0]
+    return schemaColumns
@@ -0,0 +1,195 @@
+#################################################################################################################
+## Copyright (c) 2024 PICO Developer
+## SPDX-License-Identifier: MIT
+## Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and#or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+## The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+## THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+################################################################################################################
+
+import base64
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+
+# default number of points per session plotted for a metric, the full resolution data is loaded by the report when zooming in
+DEFAULT_MAX_POINTS = 2000
+# chart series are saved as scripts loaded on demand since browsers don't allow fetching files of a local report
+# each metric has a shard with its downsampled series, loaded when its chart is shown, and the full resolution series loaded when zooming in
+SHARD_DIR = "shards"
+SERIES_DIR = "series"
+
+# indices of the points kept by Largest-Triangle-Three-Buckets downsampling, the first and last points are always kept
+# each bucket keeps the point forming the largest triangle with the previous kept point and the average of the next bucket, so peaks and hitches survive
+def lttb_indices(x, y, targetPoints):
+    n = len(x)
+    if targetPoints <= 0 or targetPoints >= n or targetPoints < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # bucket boundaries of the points between the first and the last one
+    edges = np.linspace(1, n - 1, targetPoints - 1).astype(np.int64)
+    indices = np.empty(targetPoints, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(targetPoints - 2):
+        start = edges[i]
+        end = edges[i + 1]
+        if i + 2 < len(edges):
+            avgX = x[end:edges[i + 2]].mean()
+            avgY = y[end:edges[i + 2]].mean()
+        else:
+            avgX = x[n - 1]
+            avgY = y[n - 1]
+        areas = np.abs((x[a] - avgX) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avgY - y[a]))
+        a = start + int(np.argmax(areas))
+        indices[i + 1] = a
+    return indices
+
+##### report assets #####
+# report template files are kept once per content in a store shared by the sessions of an output folder, sessions and reports link to them
+ASSET_STORE_DIR = ".xrprof_assets"
+
+def get_asset_store_dir(sessionDir):
+    return os.path.join(os.path.dirname(os.path.abspath(sessionDir)), ASSET_STORE_DIR)
+
+# make dst the same file as src without copying it where possible: hardlink, then symlink, then copy
+def link_file(src, dst):
+    if os.path.lexists(dst):
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            return
+        os.remove(dst)
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    try:
+        os.symlink(os.path.abspath(src), dst)
+        return
+    except (OSError, NotImplementedError):
+        pass
+    shutil.copy2(src, dst)
+
+def get_file_hash(path):
+    fileHash = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            fileHash.update(chunk)
+    return fileHash.hexdigest()
+
+# copy a file into the content addressed store once, returns its path in the store
+def store_file(src, storeDir):
+    digest = get_file_hash(src)
+    storePath = os.path.join(storeDir, digest[:2], digest + os.path.splitext(src)[1])
+    if not os.path.exists(storePath):
+        os.makedirs(os.path.dirname(storePath), exist_ok=True)
+        # the store is shared, write to a temporary file so other processes never see a partial asset
+        tmpPath = f"{storePath}.{os.getpid()}.tmp"
+        shutil.copyfile(src, tmpPath)
+        os.replace(tmpPath, storePath)
+    return storePath
+
+# link all files of srcDir into dstDir, through the asset store if one is given
+def link_tree(srcDir, dstDir, storeDir = None):
+    for root, dirs, files in os.walk(srcDir):
+        for name in files:
+            src = os.path.join(root, name)
+            dst = os.path.join(dstDir, os.path.relpath(src, srcDir))
+            if storeDir is not None:
+                src = store_file(src, storeDir)
+            link_file(src, dst)
+
+# report files are written in place of files that may be linked to shared assets, remove them first so the shared file is not modified
+def remove_linked_file(path):
+    if os.path.lexists(path):
+        os.remove(path)
+
+# the report data format follows the scripts, so the template next to them is used. Sessions keep a copy of the template for when the scripts are moved
+def get_report_template_dir(sessionDir):
+    templateDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "report_template")
+    if os.path.isdir(templateDir):
+        return templateDir
+    return os.path.join(sessionDir, "report_template")
+
+# chart series of a metric for one session of the report, downsampled to at most maxPoints. Returns the series and whether it was downsampled
+# session is the index of the session in the report name list, so the name is not repeated for every point
+def get_chart_series(timestamps, values, session, maxPoints = DEFAULT_MAX_POINTS):
+    indices = lttb_indices(timestamps, values, maxPoints)
+    series = {'session': session, 'x': np.asarray(timestamps, dtype=np.float64)[indices], 'y': np.asarray(values, dtype=np.float64)[indices]}
+    return series, len(indices) < len(timestamps)
+
+# writes json to a file piece by piece, numpy arrays are written in chunks so neither the document nor a whole column is converted to a string at once
+# with base64Arrays, arrays are written as {"dtype": "float64", "base64": ...} holding the little endian values, which the report decodes into typed arrays
+class StreamingJsonWriter:
+    ARRAY_CHUNK = 3 * 8192
+
+    def __init__(self, f, base64Arrays = False):
+        self.f = f
+        self.base64Arrays = base64Arrays
+
+    def write(self, value):
+        if isinstance(value, dict):
+            self.f.write("{")
+            for i, key in enumerate(value):
+                if i:
+                    self.f.write(",")
+                self.f.write(json.dumps(str(key)) + ":")
+                self.write(value[key])
+            self.f.write("}")
+        elif isinstance(value, (list, tuple)):
+            self.f.write("[")
+            for i, item in enumerate(value):
+                if i:
+                    self.f.write(",")
+                self.write(item)
+            self.f.write("]")
+        elif isinstance(value, np.ndarray):
+            self.write_array(value)
+        elif isinstance(value, np.generic):
+            self.f.write(json.dumps(value.item()))
+        else:
+            self.f.write(json.dumps(value))
+
+    def write_array(self, array):
+        array = np.ascontiguousarray(array, dtype='<f8')
+        if self.base64Arrays:
+            data = array.tobytes()
+            self.f.write('{"dtype":"float64","base64":"')
+            # chunks are a multiple of 3 bytes so the encoded chunks can be concatenated
+            for pos in range(0, len(data), self.ARRAY_CHUNK):
+                self.f.write(base64.b64encode(data[pos:pos + self.ARRAY_CHUNK]).decode())
+            self.f.write('"}')
+            return
+        self.f.write("[")
+        for pos in range(0, len(array), self.ARRAY_CHUNK):
+            if pos:
+                self.f.write(",")
+            self.f.write(json.dumps(array[pos:pos + self.ARRAY_CHUNK].tolist())[1:-1])
+        self.f.write("]")
+
+# write the report data script, metric series are stored as columns (see get_chart_series) and expanded by static/js/report.js
+# metrics may reference their series in a data shard (see write_series_script) instead of holding them, the report data is then a small manifest
+def write_report_config(configPath, config, base64Arrays = False):
+    config['format'] = "columnar"
+    remove_linked_file(configPath)
+    with open(configPath, "w") as fConfig:
+        fConfig.write("window.configJSON = ")
+        StreamingJsonWriter(fConfig, base64Arrays).write(config)
+        fConfig.write(";\n")
+
+# save the series of a metric to resource/<dirName>/<index>.js of the report, returns the path the report loads them from
+# the script registers the series under its path in window.XRReportSeries
+def write_series_script(reportResourceDir, dirName, index, series, base64Arrays = False):
+    os.makedirs(os.path.join(reportResourceDir, dirName), exist_ok=True)
+    path = f"./resource/{dirName}/{index}.js"
+    remove_linked_file(os.path.join(reportResourceDir, dirName, f"{index}.js"))
+    with open(os.path.join(reportResourceDir, dirName, f"{index}.js"), "w") as fSeries:
+        fSeries.write("window.XRReportSeries = window.XRReportSeries || {};\n")
+        fSeries.write(f"window.XRReportSeries[{json.dumps(path)}] = ")
+        StreamingJsonWriter(fSeries, base64Arrays).write(series)
+        fSeries.write(";\n")
+    return path
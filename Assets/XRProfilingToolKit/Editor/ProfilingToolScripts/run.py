@@ -8,6 +8,7 @@
 # Author: Xutong Zhou (xutong.zhou@bytedance.com)
 
 import argparse
+import asyncio
 import datetime
 import json
 import os
@@ -17,6 +18,9 @@ from enum import Enum
 import re
 import shutil
 
+from parseutil import LogcatTimeDecoder, datetime_to_ms
+from reportutil import ASSET_STORE_DIR, link_tree
+
 class Platform(Enum):
     Unknown = 0
     Pico = 1
@@ -56,6 +60,18 @@ gpu_profiler = ""
 fDeviceSpec = None
 
 json_persistent_path = f"/storage/emulated/0/Android/data/{app_id}/files/CommandQueue.json"
+
+# automation actions are dispatched through a bounded queue in the order of their log lines, a stalled device holds up the logcat reader
+# instead of piling up adb processes. Screen captures start as soon as their line is read, the other actions wait for the actions before them
+ACTION_QUEUE_SIZE = 16
+action_queue = None
+action_latencies = []
+fActionLatency = None
+# decodes the device time of the log lines, logcat leaves out the year so it is anchored on the session start
+logcat_time_decoder = None
+# device time format of the capture file names
+DEVICE_TIME_FORMAT = "+%Y%m%d%H%M%S%N"
+
 #functions
 def check_devices():
     out = subprocess.check_output(['adb', 'devices'], text = True).splitlines()
@@ -78,6 +94,20 @@ def check_platform():
     else:
         return Platform.Unknown
     
+async def adb(*args, stdout = None):
+    process = await asyncio.create_subprocess_exec("adb", *args, stdout=stdout)
+    return await process.wait()
+
+async def adb_output(*args):
+    process = await asyncio.create_subprocess_exec("adb", *args, stdout=asyncio.subprocess.PIPE)
+    output, _ = await process.communicate()
+    return output.decode('utf-8', errors='replace')
+
+# device time echoed by the last line of an adb shell command, None if the command printed nothing
+def get_echoed_time(output):
+    lines = output.strip().splitlines()
+    return lines[-1].strip() if lines else None
+
 def create_dir():
     global pxr_screencap_dir, session_dir, screencap_dir, gprobe_dir, gprobe_realtime_mode
     
@@ -99,7 +129,8 @@ def create_dir():
     shutil.copy(source_file_path, destination_file_path)
     source_file_path = os.path.join(scripts_dir, "report_template")
     destination_file_path = os.path.join(session_dir, "report_template")
-    shutil.copytree(source_file_path, destination_file_path, dirs_exist_ok=True)
+    # template files are linked from an asset store shared by all sessions of the output folder
+    link_tree(source_file_path, destination_file_path, os.path.join(os.path.dirname(session_dir), ASSET_STORE_DIR))
 
     screencap_dir = os.path.join(session_dir, "screencap")
     os.makedirs(screencap_dir)
@@ -123,53 +154,57 @@ def create_dir():
         gprobe_dir = os.path.join(session_dir, "gpu_profiler")
         os.makedirs(gprobe_dir)
 
-def start_profilingtoolkit():
+async def start_profilingtoolkit():
     global pMetrics, pGprobe, gprobe_realtime_mode
     pMetrics = start_pxr_metrics()
-    lock_cpu_level()
-    lock_gpu_level()
+    await lock_cpu_level()
+    await lock_gpu_level()
     if gprobe_realtime_mode:
         # TODO(xutong): make sampling frequency configurable
-        pGprobe = start_gprobe_realtime(1)
-
-def stop_profilingtoolkit():
-    pXRProfilingToolkitLog.terminate()
-    time.sleep(2)
-    pull_screencaps()
+        pGprobe = await start_gprobe_realtime(1)
+
+async def stop_profilingtoolkit():
+    # the logcat reader ends with the log process
+    if pXRProfilingToolkitLog.returncode is None:
+        pXRProfilingToolkitLog.terminate()
+    await asyncio.sleep(2)
+    await pull_screencaps()
     if pGprobe is not None:
         pGprobe.terminate()
     pMetrics.terminate()
 
 # pico screencap service require root access
-def cap_screen(context):
-    cur_time = subprocess.check_output(["adb", "shell", "date", "+%Y%m%d%H%M%S%N"], text=True).strip()
-    screen_cap_path = f"{pxr_screencap_dir}/{scene_name}_{context}_{feature_status}_{cur_time}.png"
+# the device time of the file name is taken by the same adb shell command right before the capture, returns it
+async def cap_screen(context, scene, status):
+    screen_cap_path = f"{pxr_screencap_dir}/{scene}_{context}_{status}_$t.png"
     if False:
-        subprocess.call(["adb", "shell", "am", "startservice", "-p", "com.bytedance.pico.screencapture", "-a", "pvr.intent.action.SCREEN_SHOT", "--es", "from", "test", "--es", "file_path", screen_cap_path, "--eia", "resolution", f"{screen_cap_w},{screen_cap_h}"])
+        command = f"am startservice -p com.bytedance.pico.screencapture -a pvr.intent.action.SCREEN_SHOT --es from test --es file_path {screen_cap_path} --eia resolution {screen_cap_w},{screen_cap_h}"
     else:
-        subprocess.call(["adb", "shell", "screencap", "-p", screen_cap_path])
+        command = f"screencap -p {screen_cap_path}"
+    return get_echoed_time(await adb_output("shell", f"t=$(date {DEVICE_TIME_FORMAT}); {command}; echo $t"))
 
 # pico screencap service require root access
-def start_screen_record():
+async def start_screen_record(scene):
     if (current_platform is Platform.Pico):
-        pxr_time = subprocess.check_output(["adb", "shell", "date", "+%Y%m%d%H%M%S%N"], text=True).strip()
-        screen_rc_path = f"{pxr_screencap_dir}/{scene_name}_{pxr_time}.mp4"
-        subprocess.call(['adb', 'shell', 'am', 'startservice', '-p', 'com.bytedance.pico.screencapture', '-a', 'pvr.intent.action.SCREEN_RECORD', '--es', 'pvr.intent.action.SCREEN_RECORD', 'COMMAND_START', '--es', 'from', 'xxx', '--es', 'file_path', screen_rc_path])
+        screen_rc_path = f"{pxr_screencap_dir}/{scene}_$t.mp4"
+        return get_echoed_time(await adb_output("shell", f"t=$(date {DEVICE_TIME_FORMAT}); am startservice -p com.bytedance.pico.screencapture -a pvr.intent.action.SCREEN_RECORD --es pvr.intent.action.SCREEN_RECORD COMMAND_START --es from xxx --es file_path {screen_rc_path}; echo $t"))
     else:
         print(f"Screen capture not supported on {current_platform}")
     
 # pico screencap service require root access
-def stop_screen_record():
+async def stop_screen_record():
     if (current_platform is Platform.Pico):
-        subprocess.call(['adb', 'shell', 'am', 'startservice', '-p', 'com.bytedance.pico.screencapture', '-a', 'pvr.intent.action.SCREEN_RECORD', '--es', 'pvr.intent.action.SCREEN_RECORD', 'COMMAND_RECORD_STOP', '--es', 'from', 'xxx'])
+        await adb('shell', 'am', 'startservice', '-p', 'com.bytedance.pico.screencapture', '-a', 'pvr.intent.action.SCREEN_RECORD', '--es', 'pvr.intent.action.SCREEN_RECORD', 'COMMAND_RECORD_STOP', '--es', 'from', 'xxx')
     else:
         print(f"Screen capture not supported on {current_platform}")
 
-def pull_screencaps():
+async def pull_screencaps():
     print(f"adb pull {pxr_screencap_dir} {screencap_dir}")
-    subprocess.check_output(["adb", "pull", pxr_screencap_dir, screencap_dir])
+    if await adb("pull", pxr_screencap_dir, screencap_dir, stdout=asyncio.subprocess.DEVNULL) != 0:
+        print(f"Failed to pull screen captures from {pxr_screencap_dir}")
+        return
     # clean up the screencap dir on device
-    subprocess.call(["adb", "shell", "rm", "-r", pxr_screencap_dir])
+    await adb("shell", "rm", "-r", pxr_screencap_dir)
 
 def update_feature_status(line):
     global feature_status
@@ -186,26 +221,97 @@ def update_scene_name(line):
     scene_name = line.split(":")[-1].strip()
     scene_name.replace("", "_")
 
-def process_line(line):
+# an automation action of a log line, run is the coroutine function doing it
+# immediate actions start when they are dispatched and run concurrently with the actions before them, the others wait for them
+class Action:
+    def __init__(self, name, context, line, run, immediate = False):
+        self.name = name
+        self.context = context
+        self.label = f"{name} {context}".strip()
+        # host time the log line was read and device time it was logged at in epoch milliseconds
+        self.receivedAt = time.monotonic()
+        self.lineTime = logcat_time_decoder.try_decode(line)
+        self.run = run
+        self.immediate = immediate
+        self.startedAt = None
+        self.task = None
+
+    async def start(self):
+        self.startedAt = time.monotonic()
+        return await self.run()
+
+async def dispatch(name, context, line, run, immediate = False):
+    action = Action(name, context, line, run, immediate)
+    await action_queue.put(action)
+    if immediate:
+        action.task = asyncio.ensure_future(action.start())
+
+# finish the actions in the order of their log lines and log their latency
+async def run_actions():
+    while True:
+        action = await action_queue.get()
+        if action is None:
+            break
+        try:
+            deviceTime = await (action.task if action.immediate else action.start())
+        except Exception as e:
+            print(f"{action.label} failed: {e}")
+            deviceTime = None
+        log_action_latency(action, time.monotonic(), deviceTime)
+
+# dispatch latency is the time from reading the log line to starting the action, done the time to finishing it
+# for actions that return the device time they happened at, device latency is the time from logging the line to the action on the device
+def log_action_latency(action, finishedAt, deviceTime):
+    latency = {'action': action.name, 'context': action.context, 'dispatch': (action.startedAt - action.receivedAt) * 1000, 'done': (finishedAt - action.receivedAt) * 1000}
+    text = f"{action.label}: dispatch {latency['dispatch']:.1f} ms, done {latency['done']:.1f} ms"
+    if deviceTime and action.lineTime is not None:
+        try:
+            latency['device'] = datetime_to_ms(datetime.datetime.strptime(deviceTime[:20], '%Y%m%d%H%M%S%f')) - action.lineTime
+            text += f", device {latency['device']:.1f} ms"
+        except ValueError:
+            pass
+    action_latencies.append(latency)
+    fActionLatency.write(text + "\n")
+    fActionLatency.flush()
+    print(text)
+
+def print_latency_summary():
+    for key in ['dispatch', 'device']:
+        values = [latency[key] for latency in action_latencies if key in latency]
+        if values:
+            print(f"Action {key} latency: avg {sum(values) / len(values):.1f} ms, max {max(values):.1f} ms over {len(values)} actions")
+
+# state updates and device specs are handled when the line is read so the actions capture the state at their line
+async def process_line(line):
     global hFov, vFov
     if "CaptureScreen" in line:
-        cap_screen(line.split(':')[-1].strip())
+        context = line.split(':')[-1].strip()
+        scene = scene_name
+        status = feature_status
+        await dispatch("CaptureScreen", context, line, lambda: cap_screen(context, scene, status), immediate=True)
     if "XRProfilingToolkit starting" in line:
-        start_profilingtoolkit()
+        await dispatch("Start", "", line, start_profilingtoolkit)
     if "XRProfilingToolkit finished" in line or "XRProfilingToolkit paused" in line:
-        stop_profilingtoolkit()
+        await dispatch("Stop", "", line, stop_profilingtoolkit)
     if "StartScreenRecord" in line:
-        start_screen_record()
+        scene = scene_name
+        await dispatch("StartScreenRecord", "", line, lambda: start_screen_record(scene))
     if "EndScreenRecord" in line:
-        stop_screen_record()
+        await dispatch("EndScreenRecord", "", line, stop_screen_record)
     if "Feature status" in line:
         update_feature_status(line)
     if "Scene loaded" in line:
         update_scene_name(line)
     if "CaptureDrawCall" in line:
-        gprobe_drawcall(line.split(':')[-1].strip())
+        context = line.split(':')[-1].strip()
+        scene = scene_name
+        status = feature_status
+        await dispatch("CaptureDrawCall", context, line, lambda: gprobe_drawcall(context, scene, status))
     if "CaptureRenderingStage" in line:
-        gprobe_stage(line.split(':')[-1].strip())
+        context = line.split(':')[-1].strip()
+        scene = scene_name
+        status = feature_status
+        await dispatch("CaptureRenderingStage", context, line, lambda: gprobe_stage(context, scene, status))
     if "$DeviceSpec" in line:
         deviceSpecStr = line.split('$DeviceSpec')[-1].strip()
         # write device spec to file
@@ -223,30 +329,32 @@ def start_pxr_metrics():
     p = subprocess.Popen(["adb", "logcat", f"{metric_command}:V", "*:S"], stdout=fMetrics, universal_newlines=True, text = True)
     return p
 
-def gprobe_stage(context):
+# run a gpu profiler capture and save its output named after the device time it started at, which is returned
+async def gprobe_capture(kind, context, scene, status, options):
+    # the device time is the first line of the output
+    pxr_time, _, output = (await adb_output("shell", f"date {DEVICE_TIME_FORMAT}; {gpu_profiler} {options}")).partition("\n")
+    pxr_time = pxr_time.strip()
+    outputPath = f"{gprobe_dir}/{kind}_{scene}_{context}_{status}_{pxr_time}.log"
+    with open(outputPath, "w") as fCapture:
+        fCapture.write(output)
+    return pxr_time
+
+async def gprobe_stage(context, scene, status):
     global gprobe_dir, gprobe_realtime_mode
     if gprobe_realtime_mode:
         print("GPU Profiler in realtime mode, unable to capture rendering stage!")
         return
-    
-    pxr_time = subprocess.check_output(["adb", "shell", "date", "+%Y%m%d%H%M%S%N"], text=True).strip()
-    outputPath = f"{gprobe_dir}/stage_{scene_name}_{context}_{feature_status}_{pxr_time}.log"
-    fDrawcall = open(outputPath, "w")
-    subprocess.call(["adb", "shell", gpu_profiler, "-t"], stdout=fDrawcall, universal_newlines=True, text = True)
+    return await gprobe_capture("stage", context, scene, status, "-t")
 
-def gprobe_drawcall(context):
+async def gprobe_drawcall(context, scene, status):
     global gprobe_dir, gprobe_realtime_mode
     if gprobe_realtime_mode:
         print("GPU Profiler in realtime mode, unable to capture drawcall!")
         return
+    return await gprobe_capture("drawcall", context, scene, status, "-x --time 0.2")
     
-    pxr_time = subprocess.check_output(["adb", "shell", "date", "+%Y%m%d%H%M%S%N"], text=True).strip()
-    outputPath = f"{gprobe_dir}/drawcall_{scene_name}_{context}_{feature_status}_{pxr_time}.log"
-    fStage = open(outputPath, "w")
-    subprocess.call(["adb", "shell", gpu_profiler, "-x", "--time", "0.2"], stdout=fStage, universal_newlines=True, text = True)
-    
-def start_gprobe_realtime(freq):
-    adb_time = subprocess.check_output(["adb", "shell", "date", "+%Y%m%d%H%M%S%N"], text=True).strip()
+async def start_gprobe_realtime(freq):
+    adb_time = (await adb_output("shell", "date", DEVICE_TIME_FORMAT)).strip()
     fGpuInfo = open(os.path.join(session_dir, "pil_output.log"), "w")
     fGpuInfo.write(f"{adb_time}\n")
     command = ["adb", "shell", gpu_profiler, "-r"]
@@ -295,15 +403,43 @@ def get_gpu_driver_info():
     vkData = json.loads(vulkanInfoJson)
     print(vkData['devices'][0]['VK_KHR_driver_properties'])
     
-def lock_gpu_level():
+async def lock_gpu_level():
     # setting performance mode through Quest sdk doesn't lock to a specific GPU level, force the level here
     if current_platform == Platform.Quest:
-        subprocess.call(['adb', 'shell', 'setprop', 'debug.oculus.gpuLevel' '3'])
+        await adb('shell', 'setprop', 'debug.oculus.gpuLevel', '3')
 
-def lock_cpu_level():
+async def lock_cpu_level():
     # setting performance mode through Quest sdk doesn't lock to a specific CPU level, force the level here
     if current_platform == Platform.Quest:
-        subprocess.call(['adb', 'shell', 'setprop', 'debug.oculus.cpuLevel' '3'])
+        await adb('shell', 'setprop', 'debug.oculus.cpuLevel', '3')
+
+# read the unity log and dispatch the automation actions of its lines until the log process ends
+async def read_profilingtoolkit_log():
+    global pXRProfilingToolkitLog
+    pXRProfilingToolkitLog = await asyncio.create_subprocess_exec("adb", "logcat", "Unity:V", "*:S", stdout=asyncio.subprocess.PIPE)
+    # the actions are always ended, or a failing reader would leave run_actions waiting forever
+    try:
+        with open(os.path.join(session_dir, "xr_profilingtoolkit.log"), "w") as fXRProfilingToolkitLog:
+            while True:
+                line = await pXRProfilingToolkitLog.stdout.readline()
+                if not line:
+                    break
+                output = line.decode('utf-8', errors='replace').strip()
+                if "XR_ProfilingToolkit" in output:
+                    fXRProfilingToolkitLog.write(output + "\n")
+                    print(output)
+                    await process_line(output)
+        print("break")
+    finally:
+        await action_queue.put(None)
+
+async def run_session():
+    global action_queue
+    action_queue = asyncio.Queue(ACTION_QUEUE_SIZE)
+    # the actions dispatched before a reader error are finished before it is raised
+    reader = asyncio.ensure_future(read_profilingtoolkit_log())
+    await run_actions()
+    await reader
 
 # main
 parser.add_argument('--file', type=str, help="Automation commands file for profilingtoolkiting")
@@ -357,25 +493,18 @@ if stderr:
     print(stderr)
     exit()
 
-session_id = "xr_profiling_session_" + datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+session_start = datetime.datetime.now()
+session_id = "xr_profiling_session_" + session_start.strftime('%Y%m%d%H%M%S')
+logcat_time_decoder = LogcatTimeDecoder(session_start)
 create_dir()
 
-pXRProfilingToolkitLog = subprocess.Popen(["adb", "logcat", "Unity:V", "*:S"], stdout=subprocess.PIPE)
 fDeviceSpec = open(os.path.join(session_dir, "device_spec.log"), "w")
 log_os_version()
 
-fXRProfilingToolkitLog = open(os.path.join(session_dir, "xr_profilingtoolkit.log"), "w")
-while True:
-    if pXRProfilingToolkitLog.poll() is None:
-        output = pXRProfilingToolkitLog.stdout.readline().decode('utf-8').strip()
-        if "XR_ProfilingToolkit" in output:
-            if output:
-                fXRProfilingToolkitLog.write(output + "\n")
-                print(output)
-                process_line(output)
-    else:
-        print("break")
-        break
+fActionLatency = open(os.path.join(session_dir, "action_latency.log"), "w")
+asyncio.run(run_session())
+fActionLatency.close()
+print_latency_summary()
 
 if args.file:
     # remove the automation file pushed to the device
@@ -0,0 +1,266 @@
+#################################################################################################################
+## Copyright (c) 2024 PICO Developer
+## SPDX-License-Identifier: MIT
+## Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and#or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+## The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+## THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+################################################################################################################
+
+import math
+import numpy as np
+
+PERCENTILES = [1, 5, 50, 95, 99]
+HISTOGRAM_BINS = 20
+# metrics whose time spent below their maxValue is reported, like fps below the display refresh rate
+BELOW_MAX_VALUE_METRICS = ["fps"]
+
+# each sample covers the time since the previous sample, the first one covers the time since the automation started
+def time_weights(timestamps):
+    weights = np.diff(np.asarray(timestamps, dtype=np.float64), prepend=0.0)
+    weights = np.clip(weights, 0.0, None)
+    if len(weights) and weights.sum() <= 0:
+        # samples without elapsed time, weight them equally
+        weights = np.ones(len(weights))
+    return weights
+
+def weighted_mean(timestamps, values):
+    weights = time_weights(timestamps)
+    return float(np.dot(weights, values) / weights.sum())
+
+# value below which the given fraction of the session time is spent, for all fractions at once
+def weighted_percentiles(sortedValues, sortedWeights, fractions):
+    cumulative = np.cumsum(sortedWeights)
+    indices = np.searchsorted(cumulative, np.asarray(fractions) * cumulative[-1], side='left')
+    return sortedValues[np.minimum(indices, len(sortedValues) - 1)]
+
+# threshold used for the time below statistic of a metric, None if it has none
+def get_threshold(name, metrics):
+    if name in BELOW_MAX_VALUE_METRICS and getattr(metrics, "maxValue", None) is not None:
+        return float(metrics.maxValue)
+    return None
+
+# time weighted statistics of a metric column over the whole session
+# weights are the time covered by each sample, computed from the timestamps if not given
+def compute_stats(timestamps, values, threshold = None, bins = HISTOGRAM_BINS, weights = None):
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return {'count': 0}
+    if weights is None:
+        weights = time_weights(timestamps)
+    duration = weights.sum()
+    if duration <= 0:
+        weights = np.ones(len(values))
+        duration = weights.sum()
+    mean = np.dot(weights, values) / duration
+
+    order = np.argsort(values, kind='stable')
+    sortedValues = values[order]
+    percentiles = weighted_percentiles(sortedValues, weights[order], [p / 100 for p in PERCENTILES])
+
+    stats = {
+        'count': len(values),
+        'duration': float(duration),
+        'mean': float(mean),
+        'min': float(sortedValues[0]),
+        'max': float(sortedValues[-1]),
+        'std': float(np.sqrt(np.dot(weights, (values - mean) ** 2) / duration)),
+    }
+    for p, value in zip(PERCENTILES, percentiles.tolist()):
+        stats[f'p{p}'] = value
+    if threshold is not None:
+        timeBelow = float(weights[values < threshold].sum())
+        stats['threshold'] = threshold
+        stats['timeBelow'] = timeBelow
+        stats['fractionBelow'] = timeBelow / duration
+    # histogram of the session time spent in each value range
+    histogram, edges = np.histogram(values, bins=bins, weights=weights)
+    stats['histogram'] = {'edges': edges.tolist(), 'time': histogram.tolist()}
+    return stats
+
+# time weighted mean, min and max of the samples within halfWindow seconds of each center time
+# the windows of all centers are found at once by binary search on the sorted timestamps
+def compute_window_stats(timestamps, values, centers, halfWindow):
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    weights = time_weights(timestamps)
+    centers = np.asarray(centers, dtype=np.float64)
+    starts = np.searchsorted(timestamps, centers - halfWindow, side='left')
+    ends = np.searchsorted(timestamps, centers + halfWindow, side='right')
+    windowStats = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        if end <= start:
+            windowStats.append({'count': 0})
+            continue
+        windowWeights = weights[start:end]
+        windowValues = values[start:end]
+        duration = windowWeights.sum()
+        windowStats.append({
+            'count': end - start,
+            'mean': float(np.dot(windowWeights, windowValues) / duration) if duration > 0 else float(windowValues.mean()),
+            'min': float(windowValues.min()),
+            'max': float(windowValues.max()),
+        })
+    return windowStats
+
+# statistics of a metric for each combination of feature states of a FeatureTimeline, all segments with the same states are combined
+# samples keep the weights they have over the whole session, so the first sample of a segment covers the time since the last sample of the previous one
+def compute_feature_stats(timestamps, values, timeline, threshold = None):
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    weights = time_weights(timestamps)
+    segments = timeline.segment_indices(timestamps)
+    combinations = timeline.combinations()
+    combinationIndices = np.array([combinations.index(state) for state in timeline.states], dtype=np.int64)
+    sampleCombinations = combinationIndices[segments]
+    featureStats = []
+    for i, state in enumerate(combinations):
+        mask = sampleCombinations == i
+        featureStats.append({
+            'features': timeline.get_label(state),
+            'flags': timeline.get_flags(state),
+            'segments': int((combinationIndices == i).sum()),
+            'stats': compute_stats(timestamps[mask], values[mask], threshold, weights=weights[mask]),
+        })
+    return featureStats
+
+##### session comparison #####
+# metrics that are better when higher, other metrics like frame times and utilization are better when lower
+HIGHER_IS_BETTER_METRICS = ["fps"]
+BOOTSTRAP_SAMPLES = 1000
+CONFIDENCE = 0.95
+SIGNIFICANCE_LEVEL = 0.05
+# fewer samples than this in a session or feature state are not compared
+MIN_COMPARE_SAMPLES = 10
+# bootstrap resamples are processed in batches of about this many samples to bound the memory used
+BOOTSTRAP_BATCH_SIZE = 1 << 22
+
+def lag1_autocorrelation(values):
+    centered = values - values.mean()
+    variance = np.dot(centered, centered)
+    if len(values) < 3 or variance <= 0:
+        return 0.0
+    return float(np.dot(centered[:-1], centered[1:]) / variance)
+
+# block length of the moving block bootstrap, long enough that a block holds the correlated neighbors of a sample
+# the n^(1/3) rate with the constant of an AR(1) series with the lag 1 autocorrelation of the values
+def get_block_length(values):
+    rho = min(max(lag1_autocorrelation(values), 0.0), 0.95)
+    if rho == 0:
+        return 1
+    length = (2 * rho / (1 - rho ** 2)) ** (2 / 3) * len(values) ** (1 / 3)
+    return int(min(max(math.ceil(length), 1), max(len(values) // 2, 1)))
+
+# indices of moving block bootstrap resamples, each row joins random runs of blockLength consecutive samples
+def block_bootstrap_indices(n, blockLength, samples, rng):
+    blocks = -(-n // blockLength)
+    starts = rng.integers(0, n - blockLength + 1, size=(samples, blocks))
+    return (starts[:, :, None] + np.arange(blockLength)).reshape(samples, -1)[:, :n]
+
+# time weighted mean and p95 of each block bootstrap resample of a series
+def bootstrap_mean_p95(values, weights, samples, rng):
+    n = len(values)
+    blockLength = get_block_length(values)
+    means = np.empty(samples)
+    p95s = np.empty(samples)
+    batch = max(BOOTSTRAP_BATCH_SIZE // n, 1)
+    for start in range(0, samples, batch):
+        indices = block_bootstrap_indices(n, blockLength, min(batch, samples - start), rng)
+        resampledValues = values[indices]
+        resampledWeights = weights[indices]
+        totals = resampledWeights.sum(axis=1)
+        means[start:start + len(indices)] = (resampledValues * resampledWeights).sum(axis=1) / totals
+        order = np.argsort(resampledValues, axis=1)
+        cumulative = np.cumsum(np.take_along_axis(resampledWeights, order, axis=1), axis=1)
+        positions = np.minimum((cumulative < 0.95 * totals[:, None]).sum(axis=1), n - 1)
+        p95s[start:start + len(indices)] = np.take_along_axis(np.take_along_axis(resampledValues, order, axis=1), positions[:, None], axis=1)[:, 0]
+    return means, p95s, blockLength
+
+# two sided Mann-Whitney U test of two series with the normal approximation, ties get their average rank
+# neighboring samples of a time series are correlated, so the test statistic is scaled to the effective number of independent samples
+def mann_whitney_u(base, other):
+    n1 = len(base)
+    n2 = len(other)
+    combined = np.concatenate([base, other])
+    _, inverse, counts = np.unique(combined, return_inverse=True, return_counts=True)
+    ends = np.cumsum(counts)
+    ranks = ((ends - counts + 1 + ends) / 2)[inverse]
+    u = float(ranks[:n1].sum() - n1 * (n1 + 1) / 2)
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - float((counts ** 3 - counts).sum()) / (n * (n - 1)))
+    if variance <= 0:
+        return u, 1.0
+    effective = min((1 - rho) / (1 + rho) for rho in [max(lag1_autocorrelation(base), 0.0), max(lag1_autocorrelation(other), 0.0)])
+    z = (u - n1 * n2 / 2) / math.sqrt(variance) * math.sqrt(effective)
+    return u, math.erfc(abs(z) / math.sqrt(2))
+
+# compare the time weighted mean and p95 of a metric of two sessions
+# the differences (other - base) get block bootstrap confidence intervals, together with the Mann-Whitney U test they decide the verdict:
+# improved or regressed when the mean difference interval excludes zero and the test is significant, inconclusive otherwise
+# weights are the time covered by each sample, computed from the timestamps if not given
+def compare_samples(baseTimestamps, baseValues, otherTimestamps, otherValues, higherIsBetter = False, samples = BOOTSTRAP_SAMPLES, seed = 0, baseWeights = None, otherWeights = None):
+    baseValues = np.asarray(baseValues, dtype=np.float64)
+    otherValues = np.asarray(otherValues, dtype=np.float64)
+    if len(baseValues) < MIN_COMPARE_SAMPLES or len(otherValues) < MIN_COMPARE_SAMPLES:
+        return {'verdict': "inconclusive", 'reason': "not enough samples"}
+    if baseWeights is None:
+        baseWeights = time_weights(baseTimestamps)
+    if otherWeights is None:
+        otherWeights = time_weights(otherTimestamps)
+    # the report is the same every time it is generated
+    rng = np.random.default_rng(seed)
+    baseMeans, baseP95s, baseBlock = bootstrap_mean_p95(baseValues, np.asarray(baseWeights, dtype=np.float64), samples, rng)
+    otherMeans, otherP95s, otherBlock = bootstrap_mean_p95(otherValues, np.asarray(otherWeights, dtype=np.float64), samples, rng)
+    baseStats = compute_stats(baseTimestamps, baseValues, weights=np.asarray(baseWeights, dtype=np.float64), bins=1)
+    otherStats = compute_stats(otherTimestamps, otherValues, weights=np.asarray(otherWeights, dtype=np.float64), bins=1)
+    tail = (1 - CONFIDENCE) / 2 * 100
+    meanCI = np.percentile(otherMeans - baseMeans, [tail, 100 - tail]).tolist()
+    p95CI = np.percentile(otherP95s - baseP95s, [tail, 100 - tail]).tolist()
+    u, p = mann_whitney_u(baseValues, otherValues)
+
+    verdict = "inconclusive"
+    if p < SIGNIFICANCE_LEVEL and (meanCI[0] > 0 or meanCI[1] < 0):
+        verdict = "improved" if (meanCI[0] > 0) == higherIsBetter else "regressed"
+    return {
+        'verdict': verdict,
+        'meanDiff': otherStats['mean'] - baseStats['mean'],
+        'meanCI': meanCI,
+        'p95Diff': otherStats['p95'] - baseStats['p95'],
+        'p95CI': p95CI,
+        'mannWhitneyU': u,
+        'pValue': p,
+        'blockLength': [baseBlock, otherBlock],
+        'confidence': CONFIDENCE,
+    }
+
+# compare_samples for each combination of feature states both sessions have, see compute_feature_stats
+def compare_feature_samples(baseTimestamps, baseValues, baseTimeline, otherTimestamps, otherValues, otherTimeline, higherIsBetter = False, samples = BOOTSTRAP_SAMPLES, seed = 0):
+    baseTimestamps = np.asarray(baseTimestamps, dtype=np.float64)
+    baseValues = np.asarray(baseValues, dtype=np.float64)
+    otherTimestamps = np.asarray(otherTimestamps, dtype=np.float64)
+    otherValues = np.asarray(otherValues, dtype=np.float64)
+    baseWeights = time_weights(baseTimestamps)
+    otherWeights = time_weights(otherTimestamps)
+    baseStates = np.array([baseTimeline.get_label(state) for state in baseTimeline.states], dtype=object)[baseTimeline.segment_indices(baseTimestamps)]
+    otherStates = np.array([otherTimeline.get_label(state) for state in otherTimeline.states], dtype=object)[otherTimeline.segment_indices(otherTimestamps)]
+    otherLabels = [otherTimeline.get_label(state) for state in otherTimeline.combinations()]
+    featureComparisons = []
+    for state in baseTimeline.combinations():
+        label = baseTimeline.get_label(state)
+        if label not in otherLabels:
+            continue
+        baseMask = baseStates == label
+        otherMask = otherStates == label
+        comparison = compare_samples(baseTimestamps[baseMask], baseValues[baseMask], otherTimestamps[otherMask], otherValues[otherMask], higherIsBetter, samples, seed, baseWeights[baseMask], otherWeights[otherMask])
+        comparison['features'] = label
+        comparison['flags'] = baseTimeline.get_flags(state)
+        featureComparisons.append(comparison)
+    return featureComparisons
+
+# format the key statistics for the metric tab of the report
+def format_stats(stats):
+    if stats['count'] == 0:
+        return "no data"
+    text = "avg: {:.2f} (p5: {:.2f}, p50: {:.2f}, p95: {:.2f})".format(stats['mean'], stats['p5'], stats['p50'], stats['p95'])
+    if 'timeBelow' in stats:
+        text += ", below {:g}: {:.1f}%".format(stats['threshold'], stats['fractionBelow'] * 100)
+    return text
@@ -10,11 +10,13 @@
 import argparse
 import os
 import webbrowser
-import json
-import shutil
 
 from datetime import datetime
 from parseutil import *
+from statsutil import compute_feature_stats, compute_stats, format_stats, get_threshold
+from hitchutil import detect_hitches, format_hitches
+from captureutil import CAPTURE_WINDOW, add_capture_diffs, add_capture_metrics, add_capture_thumbnails, build_report_thumbnails, format_session_time
+from reportutil import DEFAULT_MAX_POINTS, SERIES_DIR, SHARD_DIR, get_asset_store_dir, get_chart_series, get_report_template_dir, link_tree, write_report_config, write_series_script
 
 features = []
 
@@ -67,160 +69,170 @@ samplefeatures = ["Foveation(High)", "MSAA(4x)", "Adaptive Resolution"]
 parser = argparse.ArgumentParser(description="Script to analyze a XR ProfilingToolkit session")
 
 # main
-parser.add_argument('-s', '--session', type=str, help="XRProfilingToolkit session result directory", required=True)
-parser.add_argument('-f','--features', type=str, help="XRProfilingToolkit session features")
-args = parser.parse_args()
-
-sessionDir = args.session
-
-if args.features:
-    input_features = args.features.split('|')
-    samplefeatures = [feature for feature in input_features if feature in samplefeatures]
-
-
-if not os.path.isdir(sessionDir):
-    print("Please pass in a valid session")
-    exit()
+def main():
+    global samplefeatures
+    parser.add_argument('-s', '--session', type=str, help="XRProfilingToolkit session result directory", required=True)
+    parser.add_argument('-f','--features', type=str, help="XRProfilingToolkit session features")
+    parser.add_argument('--no-cache', action='store_true', help="Parse the session logs again instead of using the parsed session cache")
+    parser.add_argument('--max-points', type=int, default=DEFAULT_MAX_POINTS, help="Number of points each metric chart is downsampled to, 0 to plot all points")
+    parser.add_argument('--base64', action='store_true', help="Store the chart data in the report as base64 encoded binary arrays")
+    parser.add_argument('--capture-window', type=float, default=CAPTURE_WINDOW, help="Seconds of metrics before and after each screen capture summarized on its card")
+    parser.add_argument('-m', '--metrics', type=str, help="Only parse and report these metrics, separated by | (like \"FPS|FrmGpu\"). Schema names and metrics names are accepted")
+    args = parser.parse_args()
+    selectedMetrics = args.metrics.split('|') if args.metrics else None
+
+    sessionDir = args.session
+
+    if args.features:
+        input_features = args.features.split('|')
+        samplefeatures = [feature for feature in input_features if feature in samplefeatures]
+
+
+    if not os.path.isdir(sessionDir):
+        print("Please pass in a valid session")
+        exit()
     
-automationId, metricsDatas,start_time,finish_time = get_metrics_data(sessionDir)
-
-##### genertate report #####
-source_file_path = os.path.join(sessionDir, "report_template")
-destination_file_path = os.path.join(sessionDir, "analyze_report")
-shutil.copytree(source_file_path, destination_file_path, dirs_exist_ok=True)
-source_file_path = os.path.join(sessionDir+"/screencap", os.path.basename(sessionDir))
-destination_file_path = os.path.join(sessionDir+"/analyze_report/resource", "captures")
-shutil.copytree(source_file_path, destination_file_path, dirs_exist_ok=True)
-report_path = os.path.join(sessionDir+"/analyze_report", "index.html")
-# initialize report data
-config_json = {}
-config_json['type'] = "XR Profiling Session Analysis Report"
-config_json['name'] = []
-config_json['name'].append(os.path.basename(sessionDir))
-config_json['Automation Id'] = automationId
-config_json['Device Spec'] = []
-config_json['DataSet'] = []
-config_json['Captures'] = {}
-# add device spec to report
-DevicesessionData = {}
-fDeviceSpec = open(os.path.join(sessionDir, "device_spec.log"), 'r')
-deviceSpecs = fDeviceSpec.readlines()
-for specLine in deviceSpecs:
-    if 'OS version' in specLine:
-        specLinesplit = specLine.split(':', 1)
-        DevicesessionData['OS version'] = specLinesplit[1].replace('\n', '')
-    if 'Device name' in specLine:
-        specLinesplit = specLine.split(',', 1)
-        subspecLinesplit1 = specLinesplit[0].split(':', 1)
-        DevicesessionData['Device name'] = subspecLinesplit1[1].replace('\n', '')
-        subspecLinesplit2 = specLinesplit[1].split(':', 1)
-        DevicesessionData['Model'] = subspecLinesplit2[1].replace('\n', '')
-    if 'Default eye buffer size' in specLine:
-        specLinesplit = specLine.split(':', 1)
-        DevicesessionData['Default eye buffer size'] = specLinesplit[1].replace('\n', '')
-DevicesessionData['Start time(first frame)'] = start_time.strftime('%Y-%m-%d %H:%M:%S.%M')
-DevicesessionData['End time'] = finish_time.strftime('%Y-%m-%d %H:%M:%S.%M')
-config_json['Device Spec'].append(DevicesessionData)
-for name,data in metricsDatas.items():
-    if hasattr(data, "timestamps"):
-        metricsData = {}
-        metricsData['name'] = name
-        metricsData['desc'] = data.description
-        metricsData['data'] = []
-        avg_value = 0
-        for i in range(0, len(data.timestamps)):
-            subdata = {}
-            subdata['x'] = data.timestamps[i]
-            subdata['y'] = data.val[i]
-            subdata['name'] = os.path.basename(sessionDir)
-            avg_value += data.val[i]
-            metricsData['data'].append(subdata)
-        metricsData['value'] = "avg: {:.2f}".format(avg_value/len(data.timestamps))
-        config_json['DataSet'].append(metricsData)
-
-config_json['Captures']['type'] = "normal"
-config_json['Captures']['data'] = []
-
-screencaps = glob.glob(os.path.join(sessionDir, 'screencap',os.path.splitext(os.path.basename(sessionDir))[0], '*.png'))
-scenename = os.path.basename(screencaps[0]).split('_', 1)[0]
-config_json['Captures']['SceneName'] = scenename
-collection = ScreenCaptureCollection(screencaps)
-group:ScreenCaptureGroup
-for group in collection.getGroups():
-    if len(group.getOtherPaths()) == 0:
-        Capturedata = {}
-        Capturedata['Capture Content'] = os.path.basename(group.basePath).split('_', 2)[1]
-        Capturedata['info'] = []
-        Capturedata['same'] = {}
-        subCapture = []
-        subCapturebase = {}
-        sp_base_path = group.basePath
-        sp_base_name = os.path.basename(sp_base_path)
-        cap_time_str = sp_base_name.split('_', -1)[-1].split('.', 1)[0]
-        cap_time = datetime.strptime(cap_time_str[:17], '%Y%m%d%H%M%S%f')
-        subCapturebase['src'] = "./resource/captures/"+sp_base_name
-        subCapturebase['Capture Time'] = cap_time_str[:4]+"-"+cap_time_str[4:6]+"-"+cap_time_str[6:8]+" "+cap_time_str[8:10]+":"+cap_time_str[10:12]+":"+cap_time_str[12:14]+"."+cap_time_str[14:17]
-        subCapturebase['Frame Index'] = str((cap_time-start_time).seconds)
-        feature_flags = sp_base_name.rsplit('_',2)[-2]
-        if feature_flags != "None":
-            for i in range(len(samplefeatures)):
-                if feature_flags[i] == '1':
-                    Capturedata['same'][samplefeatures[i]] = "On"
-                elif feature_flags[i] == '0':
-                    Capturedata['same'][samplefeatures[i]] = "Off"
-                else:
-                    Capturedata['same'][samplefeatures[i]] = "Unknown"
-        subCapture.append(subCapturebase)
-        Capturedata['info'].append(subCapture)
-        config_json['Captures']['data'].append(Capturedata)
-    else:
-        for path in group.getOtherPaths():
+    automationId, metricsDatas,start_time,finish_time,featureTimeline,automationEvents = get_metrics_data(sessionDir, not args.no_cache, metrics=selectedMetrics)
+    valueColumns = get_value_columns(metricsDatas)
+    hitches = detect_hitches(valueColumns)
+
+    ##### genertate report #####
+    source_file_path = get_report_template_dir(sessionDir)
+    destination_file_path = os.path.join(sessionDir, "analyze_report")
+    # template and captures are linked instead of copied where the file system allows
+    link_tree(source_file_path, destination_file_path, get_asset_store_dir(sessionDir))
+    source_file_path = os.path.join(sessionDir+"/screencap", os.path.basename(sessionDir))
+    destination_file_path = os.path.join(sessionDir+"/analyze_report/resource", "captures")
+    link_tree(source_file_path, destination_file_path)
+    report_path = os.path.join(sessionDir+"/analyze_report", "index.html")
+    # initialize report data
+    config_json = {}
+    config_json['type'] = "XR Profiling Session Analysis Report"
+    config_json['name'] = []
+    config_json['name'].append(os.path.basename(sessionDir))
+    config_json['Automation Id'] = automationId
+    config_json['Device Spec'] = []
+    config_json['DataSet'] = []
+    config_json['Captures'] = {}
+    # add device spec to report
+    DevicesessionData = read_device_spec(sessionDir)
+    DevicesessionData['Start time(first frame)'] = start_time.strftime('%Y-%m-%d %H:%M:%S.%M')
+    DevicesessionData['End time'] = finish_time.strftime('%Y-%m-%d %H:%M:%S.%M')
+    DevicesessionData['Hitches'] = format_hitches(hitches)
+    config_json['Device Spec'].append(DevicesessionData)
+    # frame drops shown as bands on the metric charts
+    config_json['Hitches'] = {os.path.basename(sessionDir): hitches}
+    config_json['Feature Segments'] = {os.path.basename(sessionDir): featureTimeline.get_segments()}
+    for name,data in metricsDatas.items():
+        if hasattr(data, "timestamps"):
+            metricsData = {}
+            metricsData['name'] = name
+            metricsData['desc'] = data.description
+            # chart data is saved to a shard the report loads when the metric is shown
+            resourceDir = os.path.join(sessionDir, "analyze_report", "resource")
+            series, downsampled = get_chart_series(data.timestamps, data.val, 0, args.max_points)
+            metricsData['shard'] = write_series_script(resourceDir, SHARD_DIR, len(config_json['DataSet']), [series], args.base64)
+            # keep all points in a separate file for zooming in
+            if downsampled:
+                fullSeries, _ = get_chart_series(data.timestamps, data.val, 0, 0)
+                metricsData['fullResolution'] = write_series_script(resourceDir, SERIES_DIR, len(config_json['DataSet']), [fullSeries], args.base64)
+            # statistics are time weighted, the same as MetricsValue.average
+            stats = compute_stats(data.timestamps, data.val, get_threshold(name, data))
+            metricsData['stats'] = {os.path.basename(sessionDir): stats}
+            # statistics of each combination of feature states of the session
+            metricsData['featureStats'] = {os.path.basename(sessionDir): compute_feature_stats(data.timestamps, data.val, featureTimeline, get_threshold(name, data))}
+            metricsData['value'] = format_stats(stats)
+            config_json['DataSet'].append(metricsData)
+
+    config_json['Captures']['type'] = "normal"
+    config_json['Captures']['data'] = []
+
+    screencaps = glob.glob(os.path.join(sessionDir, 'screencap',os.path.splitext(os.path.basename(sessionDir))[0], '*.png'))
+    scenename = os.path.basename(screencaps[0]).split('_', 1)[0]
+    config_json['Captures']['SceneName'] = scenename
+    collection = ScreenCaptureCollection(screencaps)
+    group:ScreenCaptureGroup
+    for group in collection.getGroups():
+        if len(group.getOtherPaths()) == 0:
             Capturedata = {}
             Capturedata['Capture Content'] = os.path.basename(group.basePath).split('_', 2)[1]
             Capturedata['info'] = []
             Capturedata['same'] = {}
             subCapture = []
-            subCapturebase1 = {}
-            subCapturebase2 = {}
+            subCapturebase = {}
             sp_base_path = group.basePath
-            sp_path = path
             sp_base_name = os.path.basename(sp_base_path)
-            sp_name = os.path.basename(sp_path)
             cap_time_str = sp_base_name.split('_', -1)[-1].split('.', 1)[0]
             cap_time = datetime.strptime(cap_time_str[:17], '%Y%m%d%H%M%S%f')
-            subCapturebase1['src'] = "./resource/captures/"+sp_base_name
-            subCapturebase1['Capture Time'] = cap_time_str[:4]+"-"+cap_time_str[4:6]+"-"+cap_time_str[6:8]+" "+cap_time_str[8:10]+":"+cap_time_str[10:12]+":"+cap_time_str[12:14]+"."+cap_time_str[14:17]
-            subCapturebase1['Frame Index'] = str((cap_time-start_time).seconds)
-            cap_time_str = sp_name.split('_', -1)[-1].split('.', 1)[0]
-            cap_time = datetime.strptime(cap_time_str[:17], '%Y%m%d%H%M%S%f')
-            subCapturebase2['src'] = "./resource/captures/"+sp_name
-            subCapturebase2['Capture Time'] = cap_time_str[:4]+"-"+cap_time_str[4:6]+"-"+cap_time_str[6:8]+" "+cap_time_str[8:10]+":"+cap_time_str[10:12]+":"+cap_time_str[12:14]+"."+cap_time_str[14:17]
-            subCapturebase2['Frame Index'] = str((cap_time-start_time).seconds)
-            feature_flags = sp_name.rsplit('_',2)[-2]
+            subCapturebase['src'] = "./resource/captures/"+sp_base_name
+            subCapturebase['Capture Time'] = cap_time_str[:4]+"-"+cap_time_str[4:6]+"-"+cap_time_str[6:8]+" "+cap_time_str[8:10]+":"+cap_time_str[10:12]+":"+cap_time_str[12:14]+"."+cap_time_str[14:17]
+            subCapturebase['Session Time'] = format_session_time((cap_time-start_time).total_seconds())
+            feature_flags = sp_base_name.rsplit('_',2)[-2]
             if feature_flags != "None":
-                subCapturebase1['diff'] = {}
-                subCapturebase2['diff'] = {}
                 for i in range(len(samplefeatures)):
                     if feature_flags[i] == '1':
-                        subCapturebase1['diff'][samplefeatures[i]] = "Off"
-                        subCapturebase2['diff'][samplefeatures[i]] = "On"
+                        Capturedata['same'][samplefeatures[i]] = "On"
                     elif feature_flags[i] == '0':
                         Capturedata['same'][samplefeatures[i]] = "Off"
                     else:
                         Capturedata['same'][samplefeatures[i]] = "Unknown"
-            subCapture.append(subCapturebase1)
-            subCapture.append(subCapturebase2)
+            subCapture.append(subCapturebase)
             Capturedata['info'].append(subCapture)
             config_json['Captures']['data'].append(Capturedata)
+        else:
+            for path in group.getOtherPaths():
+                Capturedata = {}
+                Capturedata['Capture Content'] = os.path.basename(group.basePath).split('_', 2)[1]
+                Capturedata['info'] = []
+                Capturedata['same'] = {}
+                subCapture = []
+                subCapturebase1 = {}
+                subCapturebase2 = {}
+                sp_base_path = group.basePath
+                sp_path = path
+                sp_base_name = os.path.basename(sp_base_path)
+                sp_name = os.path.basename(sp_path)
+                cap_time_str = sp_base_name.split('_', -1)[-1].split('.', 1)[0]
+                cap_time = datetime.strptime(cap_time_str[:17], '%Y%m%d%H%M%S%f')
+                subCapturebase1['src'] = "./resource/captures/"+sp_base_name
+                subCapturebase1['Capture Time'] = cap_time_str[:4]+"-"+cap_time_str[4:6]+"-"+cap_time_str[6:8]+" "+cap_time_str[8:10]+":"+cap_time_str[10:12]+":"+cap_time_str[12:14]+"."+cap_time_str[14:17]
+                subCapturebase1['Session Time'] = format_session_time((cap_time-start_time).total_seconds())
+                cap_time_str = sp_name.split('_', -1)[-1].split('.', 1)[0]
+                cap_time = datetime.strptime(cap_time_str[:17], '%Y%m%d%H%M%S%f')
+                subCapturebase2['src'] = "./resource/captures/"+sp_name
+                subCapturebase2['Capture Time'] = cap_time_str[:4]+"-"+cap_time_str[4:6]+"-"+cap_time_str[6:8]+" "+cap_time_str[8:10]+":"+cap_time_str[10:12]+":"+cap_time_str[12:14]+"."+cap_time_str[14:17]
+                subCapturebase2['Session Time'] = format_session_time((cap_time-start_time).total_seconds())
+                feature_flags = sp_name.rsplit('_',2)[-2]
+                if feature_flags != "None":
+                    subCapturebase1['diff'] = {}
+                    subCapturebase2['diff'] = {}
+                    for i in range(len(samplefeatures)):
+                        if feature_flags[i] == '1':
+                            subCapturebase1['diff'][samplefeatures[i]] = "Off"
+                            subCapturebase2['diff'][samplefeatures[i]] = "On"
+                        elif feature_flags[i] == '0':
+                            Capturedata['same'][samplefeatures[i]] = "Off"
+                        else:
+                            Capturedata['same'][samplefeatures[i]] = "Unknown"
+                subCapture.append(subCapturebase1)
+                subCapture.append(subCapturebase2)
+                Capturedata['info'].append(subCapture)
+                config_json['Captures']['data'].append(Capturedata)
             
-# save config.js file
-config_json_str = json.dumps(config_json, indent=4)
-config_path = os.path.join(sessionDir+"/analyze_report/resource", "config.js")
-fconfig = open(config_path, "w")
-fconfig.write('window.configJSON = ')
-fconfig.write(config_json_str)
-# open the report in web browser
-webbrowser.open_new(report_path)
-print(f"Analysis report generated to {report_path}")
-
-
+    # thumbnails shown in place of the full resolution captures
+    thumbnails = build_report_thumbnails(os.path.join(sessionDir, "analyze_report"), get_asset_store_dir(sessionDir))
+    add_capture_thumbnails(config_json['Captures'], thumbnails)
+    # image difference of the captures shown side by side
+    add_capture_diffs(config_json['Captures'], os.path.join(sessionDir, "analyze_report"), get_asset_store_dir(sessionDir))
+    # metrics logged around each capture
+    add_capture_metrics(config_json['Captures'], [(start_time, valueColumns, get_pil_metrics_names(sessionDir, selectedMetrics))], args.capture_window)
+    # save config.js file
+    config_path = os.path.join(sessionDir+"/analyze_report/resource", "config.js")
+    write_report_config(config_path, config_json, args.base64)
+    # open the report in web browser
+    webbrowser.open_new(report_path)
+    print(f"Analysis report generated to {report_path}")
+
+# metrics logs may be parsed in worker processes which import this module, only run the script in the main process
+if __name__ == "__main__":
+    main()
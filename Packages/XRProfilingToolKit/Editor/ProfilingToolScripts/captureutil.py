@@ -0,0 +1,264 @@
+#################################################################################################################
+## Copyright (c) 2024 PICO Developer
+## SPDX-License-Identifier: MIT
+## Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and#or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+## The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+## THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+################################################################################################################
+
+import json
+import os
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image, features
+from reportutil import get_file_hash, link_file
+from statsutil import compute_window_stats
+
+# the report shows small previews of the screen captures and only loads the full resolution capture when it is clicked
+THUMBNAIL_SIZE = 480
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_DIR = "thumbnails"
+CAPTURE_DIR = "captures"
+
+# image difference of the capture pairs of a report, a base capture against the capture with features toggled or the same capture of another session
+# a pixel is changed when one of its channels differs by more than this many levels
+CHANGED_PIXEL_THRESHOLD = 8
+# the heatmap shows the root mean square error of each tile, tiles with this error or more get the hottest color
+HEATMAP_TILE_SIZE = 32
+HEATMAP_MAX_ERROR = 32.0
+HEATMAP_COLORS = np.array([[0, 0, 0], [255, 0, 0], [255, 255, 0], [255, 255, 255]], dtype=np.float64)
+HEATMAP_DIR = "heatmaps"
+DIFF_DIR = "diffs"
+SSIM_WINDOW = 7
+
+# capture cards show the metrics logged this many seconds before and after the capture
+CAPTURE_WINDOW = 1.0
+# metrics always shown on the capture cards if they are parsed, followed by the gpu profiler counters with the highest values around the capture
+CAPTURE_METRICS = ["fps", "FrameTime.GPU", "FrameTime.CPU"]
+CAPTURE_TOP_COUNTERS = 3
+
+# WebP when Pillow is built with it, JPEG otherwise
+def get_thumbnail_format():
+    if features.check("webp"):
+        return "WEBP", ".webp"
+    return "JPEG", ".jpg"
+
+# decoding and resizing captures is cpu bound, run the jobs in worker processes when there are several of them
+def run_image_jobs(jobs, workers = None):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if len(jobs) <= 1 or workers <= 1:
+        return [func(*args) for func, args in jobs]
+    with ProcessPoolExecutor(min(workers, len(jobs))) as executor:
+        futures = [executor.submit(func, *args) for func, args in jobs]
+        return [future.result() for future in futures]
+
+def make_thumbnail(src, dst, size, quality, imageFormat):
+    with Image.open(src) as image:
+        image = image.convert("RGB")
+        image.thumbnail((size, size), Image.LANCZOS)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        # the cache is shared by the sessions, write to a temporary file so other processes never see a partial thumbnail
+        tmpPath = f"{dst}.{os.getpid()}.tmp"
+        image.save(tmpPath, imageFormat, quality=quality)
+        os.replace(tmpPath, dst)
+    return dst
+
+# generate the thumbnails of the captures in resource/captures of a report into resource/thumbnails
+# thumbnails are cached in the asset store by the hash of the capture, so they are only generated once per capture and size
+# returns the report path of the thumbnail of each capture, keyed by the report path of the capture
+def build_report_thumbnails(reportDir, storeDir, workers = None, size = THUMBNAIL_SIZE, quality = THUMBNAIL_QUALITY):
+    imageFormat, ext = get_thumbnail_format()
+    resourceDir = os.path.join(reportDir, "resource")
+    captureDir = os.path.join(resourceDir, CAPTURE_DIR)
+    thumbnails = {}
+    links = []
+    jobs = []
+    pending = set()
+    for root, dirs, files in os.walk(captureDir):
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() != ".png":
+                continue
+            src = os.path.join(root, name)
+            relPath = os.path.relpath(src, captureDir).replace(os.sep, "/")
+            thumbnailPath = os.path.splitext(relPath)[0] + ext
+            digest = get_file_hash(src)
+            cachePath = os.path.join(storeDir, THUMBNAIL_DIR, digest[:2], f"{digest}_{size}_q{quality}{ext}")
+            if not os.path.exists(cachePath) and cachePath not in pending:
+                pending.add(cachePath)
+                jobs.append((make_thumbnail, (src, cachePath, size, quality, imageFormat)))
+            links.append((cachePath, os.path.join(resourceDir, THUMBNAIL_DIR, thumbnailPath)))
+            thumbnails[f"./resource/{CAPTURE_DIR}/{relPath}"] = f"./resource/{THUMBNAIL_DIR}/{thumbnailPath}"
+    run_image_jobs(jobs, workers)
+    for cachePath, dst in links:
+        link_file(cachePath, dst)
+    return thumbnails
+
+def load_capture(path, size = None):
+    with Image.open(path) as image:
+        image = image.convert("RGB")
+        if size is not None and image.size != size:
+            image = image.resize(size, Image.BILINEAR)
+        return np.asarray(image)
+
+# mean of each window x window block of an image, computed with a summed area table
+def box_filter(image, window):
+    sums = np.pad(image, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    return (sums[window:, window:] - sums[:-window, window:] - sums[window:, :-window] + sums[:-window, :-window]) / (window * window)
+
+# structural similarity of two luma images with a uniform window
+# the images are first downsampled so the smaller side is about 256 pixels, as recommended by the SSIM authors for images seen from a typical distance
+def compute_ssim(x, y, window = SSIM_WINDOW):
+    factor = max(1, int(round(min(x.shape) / 256)))
+    if factor > 1:
+        h = x.shape[0] // factor * factor
+        w = x.shape[1] // factor * factor
+        x = x[:h, :w].reshape(h // factor, factor, w // factor, factor).mean(axis=(1, 3))
+        y = y[:h, :w].reshape(h // factor, factor, w // factor, factor).mean(axis=(1, 3))
+    window = min(window, *x.shape)
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    meanX = box_filter(x, window)
+    meanY = box_filter(y, window)
+    varX = box_filter(x * x, window) - meanX * meanX
+    varY = box_filter(y * y, window) - meanY * meanY
+    covXY = box_filter(x * y, window) - meanX * meanY
+    ssim = ((2 * meanX * meanY + c1) * (2 * covXY + c2)) / ((meanX * meanX + meanY * meanY + c1) * (varX + varY + c2))
+    return float(ssim.mean())
+
+# root mean square error of each tile of a per pixel squared error image, border tiles may be smaller
+def get_tile_errors(squaredError, tileSize):
+    rows = np.arange(0, squaredError.shape[0], tileSize)
+    cols = np.arange(0, squaredError.shape[1], tileSize)
+    sums = np.add.reduceat(np.add.reduceat(squaredError, rows, axis=0), cols, axis=1)
+    counts = np.outer(np.diff(np.append(rows, squaredError.shape[0])), np.diff(np.append(cols, squaredError.shape[1])))
+    return np.sqrt(sums / counts)
+
+# color the tile errors from black to red, yellow and white, scaled up so the heatmap is about the thumbnail size
+def save_heatmap(tileErrors, path):
+    pos = np.clip(tileErrors / HEATMAP_MAX_ERROR, 0.0, 1.0) * (len(HEATMAP_COLORS) - 1)
+    index = np.minimum(pos.astype(np.int64), len(HEATMAP_COLORS) - 2)
+    t = (pos - index)[..., None]
+    rgb = HEATMAP_COLORS[index] * (1 - t) + HEATMAP_COLORS[index + 1] * t
+    image = Image.fromarray(np.round(rgb).astype(np.uint8), "RGB")
+    scale = max(1, THUMBNAIL_SIZE // max(tileErrors.shape))
+    image = image.resize((image.width * scale, image.height * scale), Image.NEAREST)
+    tmpPath = f"{path}.{os.getpid()}.tmp"
+    image.save(tmpPath, "PNG")
+    os.replace(tmpPath, path)
+
+# difference metrics of a capture pair, the other capture is resized to the base capture if their sizes differ
+# writes the heatmap and the metrics next to each other in the cache, runs in a worker process
+def diff_capture_pair(basePath, otherPath, cachePath, heatmapPath, tileSize = HEATMAP_TILE_SIZE):
+    base = load_capture(basePath)
+    other = load_capture(otherPath, (base.shape[1], base.shape[0]))
+    diff = base.astype(np.int16) - other.astype(np.int16)
+    squaredError = np.square(diff, dtype=np.int32).sum(axis=2, dtype=np.float64) / 3
+    mse = float(squaredError.mean())
+    luma = np.array([0.299, 0.587, 0.114])
+    tileErrors = get_tile_errors(squaredError, tileSize)
+    # None for identical captures
+    psnr = float(10 * np.log10(255 * 255 / mse)) if mse > 0 else None
+    metrics = {
+        'psnr': psnr,
+        'ssim': compute_ssim(base @ luma, other @ luma),
+        'changedFraction': float((np.abs(diff).max(axis=2) > CHANGED_PIXEL_THRESHOLD).mean()),
+        'rmse': float(np.sqrt(mse)),
+        'maxTileError': float(tileErrors.max()),
+        'tileSize': tileSize,
+        'width': base.shape[1],
+        'height': base.shape[0],
+    }
+    os.makedirs(os.path.dirname(cachePath), exist_ok=True)
+    save_heatmap(tileErrors, heatmapPath)
+    tmpPath = f"{cachePath}.{os.getpid()}.tmp"
+    with open(tmpPath, "w") as f:
+        json.dump(metrics, f)
+    os.replace(tmpPath, cachePath)
+    return metrics
+
+def format_capture_diff(metrics):
+    return {
+        'PSNR': "identical" if metrics['psnr'] is None else "{:.2f} dB".format(metrics['psnr']),
+        'SSIM': "{:.4f}".format(metrics['ssim']),
+        'Changed Pixels': "{:.2f}%".format(metrics['changedFraction'] * 100),
+    }
+
+# compare the captures shown side by side in the report data, the metrics and the heatmap are added to each capture after the first one
+# which they are compared with. Results are cached in the asset store by the hashes of both captures
+def add_capture_diffs(captures, reportDir, storeDir, workers = None, tileSize = HEATMAP_TILE_SIZE):
+    resourceDir = os.path.join(reportDir, "resource")
+    pairs = []
+    jobs = []
+    pending = set()
+    for captureData in captures['data']:
+        for subCapture in captureData['info']:
+            if len(subCapture) < 2:
+                continue
+            basePath = os.path.join(reportDir, subCapture[0]['src'])
+            if not os.path.isfile(basePath):
+                continue
+            baseHash = get_file_hash(basePath)
+            for capture in subCapture[1:]:
+                otherPath = os.path.join(reportDir, capture['src'])
+                # a session of a comparison may not have the capture
+                if not os.path.isfile(otherPath):
+                    continue
+                otherHash = get_file_hash(otherPath)
+                cachePath = os.path.join(storeDir, DIFF_DIR, baseHash[:2], f"{baseHash}_{otherHash}_t{tileSize}.json")
+                heatmapPath = os.path.splitext(cachePath)[0] + ".png"
+                if not os.path.exists(cachePath) and cachePath not in pending:
+                    pending.add(cachePath)
+                    jobs.append((diff_capture_pair, (basePath, otherPath, cachePath, heatmapPath, tileSize)))
+                pairs.append((capture, cachePath, heatmapPath))
+    run_image_jobs(jobs, workers)
+    for capture, cachePath, heatmapPath in pairs:
+        with open(cachePath, "r") as f:
+            metrics = json.load(f)
+        heatmap = os.path.splitext(capture['src'][len(f"./resource/{CAPTURE_DIR}/"):])[0] + ".png"
+        link_file(heatmapPath, os.path.join(resourceDir, HEATMAP_DIR, heatmap))
+        capture.update(format_capture_diff(metrics))
+        capture['heatmap'] = f"./resource/{HEATMAP_DIR}/{heatmap}"
+        capture['imageDiff'] = metrics
+
+# device time of a capture from its file name, like CyberAlley_View1_000_20250128100040423000000.png
+def get_capture_time(src):
+    timeStr = os.path.splitext(os.path.basename(src))[0].split('_')[-1]
+    return datetime.strptime(timeStr[:17], '%Y%m%d%H%M%S%f')
+
+# time of a capture since the start of its session as shown on the capture cards
+def format_session_time(seconds):
+    return "{:.3f} s".format(seconds)
+
+# link each capture of the report data to the metrics logged around it, see compute_window_stats
+# sessions holds the (start time, value columns, gpu profiler counter names) of each session of the report
+# in a comparison report the captures of an entry belong to the session of their position in the entry
+def add_capture_metrics(captures, sessions, window = CAPTURE_WINDOW):
+    sessionCaptures = [[] for session in sessions]
+    for captureData in captures['data']:
+        for subCapture in captureData['info']:
+            for position, capture in enumerate(subCapture):
+                if os.path.basename(capture['src']):
+                    sessionCaptures[position if len(sessions) > 1 else 0].append(capture)
+
+    for (start_time, columns, counterNames), cards in zip(sessions, sessionCaptures):
+        if not cards:
+            continue
+        centers = [(get_capture_time(capture['src']) - start_time).total_seconds() for capture in cards]
+        linked = {name: compute_window_stats(metrics.timestamps, metrics.val, centers, window) for name, metrics in columns.items()}
+        for i, capture in enumerate(cards):
+            windowStats = {name: linked[name][i] for name in linked if linked[name][i]['count'] > 0}
+            counters = sorted((name for name in windowStats if name in counterNames), key=lambda name: windowStats[name]['mean'], reverse=True)
+            capture['Session Time'] = format_session_time(centers[i])
+            for name in [name for name in CAPTURE_METRICS if name in windowStats] + counters[:CAPTURE_TOP_COUNTERS]:
+                capture[name] = "avg: {:.2f}, max: {:.2f}".format(windowStats[name]['mean'], windowStats[name]['max'])
+            capture['metrics'] = {'time': centers[i], 'window': window, 'stats': windowStats}
+
+# set the thumbnail of the captures of the report data
+def add_capture_thumbnails(captures, thumbnails):
+    for captureData in captures['data']:
+        for subCapture in captureData['info']:
+            for capture in subCapture:
+                if capture['src'] in thumbnails:
+                    capture['thumbnail'] = thumbnails[capture['src']]
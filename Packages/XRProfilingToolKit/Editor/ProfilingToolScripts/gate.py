@@ -0,0 +1,90 @@
+#################################################################################################################
+## Copyright (c) 2024 PICO Developer
+## SPDX-License-Identifier: MIT
+## Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and#or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+## The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+## THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+################################################################################################################
+
+
+import argparse
+import json
+import os
+import sys
+
+from parseutil import get_sessions_metrics_data, get_value_columns
+from gateutil import DEFAULT_GATE_TOLERANCE, evaluate_baseline, evaluate_budgets, format_junit, get_budget_metrics, get_gate_result, load_budget_file
+
+# exit codes, a regression fails the build and bad arguments are told apart from it
+EXIT_PASSED = 0
+EXIT_FAILED = 1
+EXIT_ERROR = 2
+
+parser = argparse.ArgumentParser(description="Script to check a XRProfilingToolkit session against performance budgets or a baseline session, exits with 1 on regression")
+
+# main
+def main():
+    parser.add_argument('-s', '--session', type=str, help="XRProfilingToolkit session result directory", required=True)
+    parser.add_argument('-b', '--budget', type=str, help="Budget file with the budgets of the metrics and the tolerances against the baseline, see gateutil.py")
+    parser.add_argument('--baseline', type=str, help="Baseline session directory the session is compared with")
+    parser.add_argument('--tolerance', type=float, help=f"Fraction a statistic may be worse than the baseline, wins over the tolerance of the budget file (default {DEFAULT_GATE_TOLERANCE})")
+    parser.add_argument('--require-significance', action='store_true', help="Only fail a change beyond the tolerance when the significance test finds a regression")
+    parser.add_argument('-m', '--metrics', type=str, help="Only compare these metrics with the baseline, separated by | (like \"FPS|FrmGpu\")")
+    parser.add_argument('--format', type=str, choices=['json', 'junit'], default='json', help="Result format")
+    parser.add_argument('-o', '--output', type=str, help="Write the result to this file instead of the standard output")
+    parser.add_argument('--no-cache', action='store_true', help="Parse the session logs again instead of using the parsed session cache")
+    args = parser.parse_args()
+
+    if not args.budget and not args.baseline:
+        print("Please pass in a budget file or a baseline session", file=sys.stderr)
+        sys.exit(EXIT_ERROR)
+    sessionDirs = [args.session] + ([args.baseline] if args.baseline else [])
+    if not all(os.path.isdir(sessionDir) for sessionDir in sessionDirs):
+        print("Please pass in valid session directories", file=sys.stderr)
+        sys.exit(EXIT_ERROR)
+
+    try:
+        budget = load_budget_file(args.budget) if args.budget else {}
+    except (OSError, ValueError) as e:
+        print(f"Failed to load budget file {args.budget}: {e}", file=sys.stderr)
+        sys.exit(EXIT_ERROR)
+    compareMetrics = args.metrics.split('|') if args.metrics else None
+    # only the checked metrics are parsed, all of them when every metric is compared with the baseline
+    selectedMetrics = None
+    if not args.baseline:
+        selectedMetrics = get_budget_metrics(budget)
+    elif compareMetrics is not None:
+        selectedMetrics = compareMetrics + get_budget_metrics(budget)
+
+    # a corrupt or partial session fails in the parser with all kinds of errors (missing logs, truncated lines, empty logs)
+    # it is reported as an error so a broken capture is not taken for a regression
+    try:
+        parsed = get_sessions_metrics_data(sessionDirs, not args.no_cache, metrics=selectedMetrics)
+        sessions = [(get_value_columns(result[1]), result[4], sessionDir) for sessionDir, result in zip(sessionDirs, parsed)]
+
+        checks = evaluate_budgets(budget, sessions[0])
+        if args.baseline:
+            checks += evaluate_baseline(budget, sessions[0], sessions[1], args.tolerance, args.require_significance, compareMetrics)
+    except Exception as e:
+        print(f"Failed to check {' and '.join(sessionDirs)}: {type(e).__name__}: {e}", file=sys.stderr)
+        sys.exit(EXIT_ERROR)
+    # a gate that checks nothing would always pass
+    if not checks:
+        print("Nothing was checked, the budget file has no budgets and the sessions have no metrics to compare", file=sys.stderr)
+        sys.exit(EXIT_ERROR)
+    result = get_gate_result(os.path.basename(os.path.normpath(args.session)), os.path.basename(os.path.normpath(args.baseline)) if args.baseline else None, checks)
+
+    output = json.dumps(result, indent=2) if args.format == 'json' else format_junit(result)
+    if args.output:
+        with open(args.output, "w") as fOutput:
+            fOutput.write(output + "\n")
+    else:
+        print(output)
+    for check in checks:
+        if not check['passed']:
+            print(f"FAILED {check['name']}: {check['message']}", file=sys.stderr)
+    sys.exit(EXIT_PASSED if result['passed'] else EXIT_FAILED)
+
+# metrics logs may be parsed in worker processes which import this module, only run the script in the main process
+if __name__ == "__main__":
+    main()
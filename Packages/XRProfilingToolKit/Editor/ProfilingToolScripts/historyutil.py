@@ -0,0 +1,224 @@
+#################################################################################################################
+## Copyright (c) 2024 PICO Developer
+## SPDX-License-Identifier: MIT
+## Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and#or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+## The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+## THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+################################################################################################################
+
+
+import os
+import sqlite3
+from datetime import datetime
+import numpy as np
+
+from parseutil import get_schema_columns, get_sessions_metrics_data, get_value_columns, read_device_spec
+from gateutil import resolve_metric
+from statsutil import PERCENTILES, compute_stats, get_threshold
+from hitchutil import detect_hitches
+from reportutil import lttb_indices
+
+##### performance history #####
+# parsed sessions are summarized into a sqlite database so trends over many sessions are queried without parsing their logs again
+HISTORY_DB_NAME = "xrprof_history.db"
+HISTORY_SCHEMA_VERSION = 1
+# statistics of compute_stats kept for each metric of a session
+HISTORY_STATS = ['count', 'duration', 'mean', 'min', 'max', 'std'] + [f'p{p}' for p in PERCENTILES] + ['fractionBelow']
+# sessions parsed at once while ingesting, their logs are parsed by one pool of worker processes
+INGEST_BATCH_SIZE = 8
+
+HISTORY_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    path TEXT NOT NULL,
+    automation_id TEXT,
+    device TEXT,
+    model TEXT,
+    os_version TEXT,
+    serial TEXT,
+    eye_buffer_size TEXT,
+    start_time TEXT,
+    finish_time TEXT,
+    duration REAL,
+    hitches INTEGER,
+    ingested_at TEXT
+);
+CREATE TABLE IF NOT EXISTS metric_stats (
+    session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    metric TEXT NOT NULL,
+    {", ".join(f'"{stat}" REAL' for stat in HISTORY_STATS)},
+    PRIMARY KEY (session_id, metric)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS metric_series (
+    session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    metric TEXT NOT NULL,
+    x BLOB NOT NULL,
+    y BLOB NOT NULL,
+    PRIMARY KEY (session_id, metric)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS metric_names (
+    name TEXT PRIMARY KEY,
+    metric TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sessions_device ON sessions(device, start_time);
+CREATE INDEX IF NOT EXISTS sessions_serial ON sessions(serial, start_time);
+CREATE INDEX IF NOT EXISTS sessions_automation_id ON sessions(automation_id, start_time);
+CREATE INDEX IF NOT EXISTS sessions_start_time ON sessions(start_time);
+CREATE INDEX IF NOT EXISTS metric_stats_metric ON metric_stats(metric, session_id);
+"""
+
+# session directories under the given paths, a path is either a session directory or a folder holding session directories
+def find_session_dirs(paths):
+    sessionDirs = []
+    for path in paths:
+        if os.path.isfile(os.path.join(path, "xr_profilingtoolkit.log")):
+            sessionDirs.append(path)
+        elif os.path.isdir(path):
+            sessionDirs.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if os.path.isfile(os.path.join(path, name, "xr_profilingtoolkit.log")))
+    return sessionDirs
+
+# query filters of the session table, dates are compared as iso strings so a date like 2025-01-28 selects from its start
+def get_session_filters(device = None, serial = None, automationId = None, since = None, until = None):
+    conditions = []
+    values = []
+    for column, value in [("s.device", device), ("s.serial", serial), ("s.automation_id", automationId)]:
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            values.append(value)
+    if since is not None:
+        conditions.append("s.start_time >= ?")
+        values.append(since)
+    if until is not None:
+        conditions.append("s.start_time < ?")
+        values.append(until)
+    return (" AND " + " AND ".join(conditions) if conditions else ""), values
+
+class HistoryStore:
+    def __init__(self, dbPath):
+        self.connection = sqlite3.connect(dbPath)
+        self.connection.row_factory = sqlite3.Row
+        # readers are not blocked while the nightly sessions are ingested
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, HISTORY_SCHEMA_VERSION):
+            raise ValueError(f"{dbPath} has history schema version {version}, expected {HISTORY_SCHEMA_VERSION}")
+        with self.connection:
+            self.connection.executescript(HISTORY_SCHEMA)
+            self.connection.execute(f"PRAGMA user_version={HISTORY_SCHEMA_VERSION}")
+
+    def close(self):
+        self.connection.close()
+
+    def has_session(self, name):
+        return self.connection.execute("SELECT 1 FROM sessions WHERE name = ?", (name,)).fetchone() is not None
+
+    # add a parsed session (see get_metrics_data) to the history, replacing it if it was added before
+    # maxPoints is the number of points of the downsampled series kept for each metric, no series are kept if it is 0
+    def add_session(self, sessionDir, parsed, maxPoints = 0):
+        automationId, metricsData, start_time, finish_time = parsed[:4]
+        name = os.path.basename(os.path.normpath(sessionDir))
+        deviceSpec = read_device_spec(sessionDir, includeSerial=True) if os.path.isfile(os.path.join(sessionDir, "device_spec.log")) else {}
+        valueColumns = get_value_columns(metricsData)
+        hitches = detect_hitches(valueColumns)
+        with self.connection:
+            self.connection.execute("DELETE FROM sessions WHERE name = ?", (name,))
+            sessionId = self.connection.execute(
+                "INSERT INTO sessions (name, path, automation_id, device, model, os_version, serial, eye_buffer_size, start_time, finish_time, duration, hitches, ingested_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, os.path.abspath(sessionDir), automationId,
+                 deviceSpec.get('Device name', "").strip(), deviceSpec.get('Model', "").strip(), deviceSpec.get('OS version', "").strip(),
+                 deviceSpec.get('Device serial number', "").strip(), deviceSpec.get('Default eye buffer size', "").strip(),
+                 start_time.isoformat(), finish_time.isoformat(), (finish_time - start_time).total_seconds(), len(hitches), datetime.now().isoformat())).lastrowid
+            statsRows = []
+            seriesRows = []
+            for metric, data in valueColumns.items():
+                stats = compute_stats(data.timestamps, data.val, get_threshold(metric, data))
+                statsRows.append([sessionId, metric] + [stats.get(stat) for stat in HISTORY_STATS])
+                if maxPoints and len(data.timestamps):
+                    indices = lttb_indices(data.timestamps, data.val, maxPoints)
+                    seriesRows.append((sessionId, metric, np.asarray(data.timestamps, dtype='<f8')[indices].tobytes(), np.asarray(data.val, dtype='<f8')[indices].tobytes()))
+            self.connection.executemany(f"INSERT INTO metric_stats VALUES ({', '.join('?' * (len(HISTORY_STATS) + 2))})", statsRows)
+            self.connection.executemany("INSERT INTO metric_series VALUES (?, ?, ?, ?)", seriesRows)
+            # schema names of the metrics (like FrmGpu) so they can be queried like in gate.py
+            schemaColumns = get_schema_columns(sessionDir)
+            self.connection.executemany("INSERT OR REPLACE INTO metric_names VALUES (?, ?)", [(name, column) for name, column in schemaColumns.items() if column in valueColumns])
+        return sessionId
+
+    # parse and add sessions, sessions already in the history are skipped unless force is set
+    # a corrupt or partial session doesn't stop the others. Returns the names of the added sessions and (session directory, error) of the failed ones
+    def ingest(self, sessionDirs, useCache = True, workers = None, metrics = None, maxPoints = 0, force = False):
+        if not force:
+            sessionDirs = [sessionDir for sessionDir in sessionDirs if not self.has_session(os.path.basename(os.path.normpath(sessionDir)))]
+        added = []
+        failed = []
+        for start in range(0, len(sessionDirs), INGEST_BATCH_SIZE):
+            batch = sessionDirs[start:start + INGEST_BATCH_SIZE]
+            try:
+                parsedBatch = get_sessions_metrics_data(batch, useCache, workers, metrics)
+            except Exception:
+                # the sessions of a batch are parsed together, parse them one by one to find the failing ones
+                parsedBatch = [self.try_parse(sessionDir, useCache, workers, metrics) for sessionDir in batch]
+            for sessionDir, parsed in zip(batch, parsedBatch):
+                if isinstance(parsed, Exception):
+                    failed.append((sessionDir, parsed))
+                    continue
+                try:
+                    self.add_session(sessionDir, parsed, maxPoints)
+                except Exception as e:
+                    failed.append((sessionDir, e))
+                    continue
+                added.append(os.path.basename(os.path.normpath(sessionDir)))
+        return added, failed
+
+    # parsed session, or the error parsing it
+    def try_parse(self, sessionDir, useCache, workers, metrics):
+        try:
+            return get_sessions_metrics_data([sessionDir], useCache, workers, metrics)[0]
+        except Exception as e:
+            return e
+
+    # sessions matching the filters, see get_session_filters. Rows are dicts in start time order
+    def get_sessions(self, device = None, serial = None, automationId = None, since = None, until = None):
+        where, values = get_session_filters(device, serial, automationId, since, until)
+        rows = self.connection.execute(f"SELECT s.* FROM sessions s WHERE 1 = 1{where} ORDER BY s.start_time", values)
+        return [dict(row) for row in rows]
+
+    # a statistic of a metric in each session matching the filters, in start time order
+    def get_trend(self, metric, stat = 'mean', device = None, serial = None, automationId = None, since = None, until = None):
+        if stat not in HISTORY_STATS:
+            raise ValueError(f"Unknown statistic {stat}, expected one of {', '.join(HISTORY_STATS)}")
+        where, values = get_session_filters(device, serial, automationId, since, until)
+        rows = self.connection.execute(
+            f'SELECT s.name, s.start_time, s.device, s.serial, s.automation_id, m."{stat}" AS value FROM metric_stats m JOIN sessions s ON s.id = m.session_id '
+            f'WHERE m.metric = ?{where} ORDER BY s.start_time', [metric] + values)
+        return [dict(row) for row in rows]
+
+    # statistics of all metrics of a session
+    def get_session_stats(self, name):
+        rows = self.connection.execute("SELECT m.* FROM metric_stats m JOIN sessions s ON s.id = m.session_id WHERE s.name = ? ORDER BY m.metric", (name,))
+        return {row['metric']: {stat: row[stat] for stat in HISTORY_STATS} for row in rows}
+
+    # downsampled series of a metric of a session as (timestamps, values), None if it was not kept
+    def get_series(self, name, metric):
+        row = self.connection.execute("SELECT m.x, m.y FROM metric_series m JOIN sessions s ON s.id = m.session_id WHERE s.name = ? AND m.metric = ?", (name, metric)).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row['x'], dtype='<f8'), np.frombuffer(row['y'], dtype='<f8')
+
+    def get_metrics(self):
+        return [row[0] for row in self.connection.execute("SELECT DISTINCT metric FROM metric_stats ORDER BY metric")]
+
+    # schema names of each metric, like FrameTime.GPU to [frmgpu]. Names are casefolded
+    def get_metric_names(self):
+        names = {}
+        for row in self.connection.execute("SELECT name, metric FROM metric_names ORDER BY name"):
+            names.setdefault(row['metric'], []).append(row['name'])
+        return names
+
+    # metric of the history given by its metrics name or schema name like in gate.py, None if the history has no such metric
+    def resolve_metric(self, name):
+        schemaColumns = {row['name']: row['metric'] for row in self.connection.execute("SELECT name, metric FROM metric_names")}
+        return resolve_metric(name, self.get_metrics(), schemaColumns)
@@ -0,0 +1,124 @@
+#################################################################################################################
+## Copyright (c) 2024 PICO Developer
+## SPDX-License-Identifier: MIT
+## Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and#or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+## The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+## THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+################################################################################################################
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# fps samples dropping this share of the frames of the display refresh rate are hitches
+FPS_DROP_FRACTION = 0.05
+# frame time samples exceeding the median of the surrounding samples by this ratio and by at least this many milliseconds are hitches
+FRAME_TIME_METRICS = ["FrameTime.GPU", "FrameTime.CPU"]
+SPIKE_RATIO = 1.5
+SPIKE_MIN_MS = 2.0
+ROLLING_MEDIAN_SAMPLES = 31
+# VrApi frame counters are the number of stale, early or torn frames of the last second, any of them is a hitch
+FRAME_COUNTER_METRICS = ["stale", "early", "tear"]
+DEFAULT_REFRESH_RATE = 72
+# severity is the share of the frame budget lost, from 0 to 1
+SEVERITY_LEVELS = [(0.5, "critical"), (0.2, "major"), (0.0, "minor")]
+
+# median of the window of samples centered on each sample, the series is extended with its first and last value at the ends
+def rolling_median(values, window):
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return values
+    half = min(window, len(values)) // 2
+    padded = np.pad(values, half, mode='edge')
+    return np.median(sliding_window_view(padded, 2 * half + 1), axis=1)
+
+def detect_fps_drops(fps):
+    values = np.asarray(fps.val, dtype=np.float64)
+    dropped = np.clip((fps.maxValue - values) / fps.maxValue, 0.0, 1.0)
+    return dropped >= FPS_DROP_FRACTION, dropped
+
+def detect_frame_time_spikes(frameTime):
+    values = np.asarray(frameTime.val, dtype=np.float64)
+    median = rolling_median(values, ROLLING_MEDIAN_SAMPLES)
+    excess = values - median
+    spikes = (values > median * SPIKE_RATIO) & (excess >= SPIKE_MIN_MS)
+    return spikes, np.clip(excess / np.maximum(values, 1e-9), 0.0, 1.0)
+
+def detect_frame_counters(counter, refreshRate):
+    values = np.asarray(counter.val, dtype=np.float64)
+    return values > 0, np.clip(values / refreshRate, 0.0, 1.0)
+
+def get_severity_level(severity):
+    for minSeverity, level in SEVERITY_LEVELS:
+        if severity >= minSeverity:
+            return level
+    return SEVERITY_LEVELS[-1][1]
+
+# find the intervals of the session where frames were dropped from the metrics columns of a session, see parseutil.get_value_columns
+# each flagged sample covers the time since the previous sample, overlapping or touching samples of all detectors are merged into one hitch
+# returns the hitches in time order with their start and end in seconds since the session start, severity, level and the metrics flagging them
+def detect_hitches(columns):
+    detections = []
+    fps = columns.get("fps")
+    refreshRate = DEFAULT_REFRESH_RATE
+    if fps is not None and fps.maxValue:
+        refreshRate = float(fps.maxValue)
+        detections.append(("fps", fps, detect_fps_drops(fps)))
+    for name in FRAME_TIME_METRICS:
+        if name in columns:
+            detections.append((name, columns[name], detect_frame_time_spikes(columns[name])))
+    for name in FRAME_COUNTER_METRICS:
+        if name in columns:
+            detections.append((name, columns[name], detect_frame_counters(columns[name], refreshRate)))
+
+    reasons = []
+    starts = []
+    ends = []
+    severities = []
+    for i, (name, metrics, (flagged, severity)) in enumerate(detections):
+        timestamps = np.asarray(metrics.timestamps, dtype=np.float64)
+        previous = np.concatenate(([0.0], timestamps[:-1]))
+        indices = np.flatnonzero(flagged)
+        reasons.append(np.full(len(indices), i))
+        starts.append(previous[indices])
+        ends.append(timestamps[indices])
+        severities.append(severity[indices])
+    if not detections or sum(len(r) for r in reasons) == 0:
+        return []
+
+    reasons = np.concatenate(reasons)
+    starts = np.concatenate(starts)
+    ends = np.concatenate(ends)
+    severities = np.concatenate(severities)
+    order = np.argsort(starts, kind='stable')
+    reasons, starts, ends, severities = reasons[order], starts[order], ends[order], severities[order]
+    # a hitch starts at a flagged sample starting after the end of all samples before it
+    newHitch = np.ones(len(starts), dtype=bool)
+    newHitch[1:] = starts[1:] > np.maximum.accumulate(ends)[:-1]
+    hitchStarts = np.flatnonzero(newHitch)
+    hitchEnds = np.maximum.reduceat(ends, hitchStarts)
+    hitchSeverities = np.maximum.reduceat(severities, hitchStarts)
+    hitchIds = np.cumsum(newHitch) - 1
+
+    hitches = []
+    for i, start in enumerate(hitchStarts.tolist()):
+        severity = float(hitchSeverities[i])
+        hitches.append({
+            'start': float(starts[start]),
+            'end': float(hitchEnds[i]),
+            'duration': float(hitchEnds[i] - starts[start]),
+            'severity': severity,
+            'level': get_severity_level(severity),
+            'metrics': [detections[r][0] for r in np.unique(reasons[hitchIds == i]).tolist()],
+        })
+    return hitches
+
+# summary shown with the device specification of the session
+def format_hitches(hitches):
+    if not hitches:
+        return "none"
+    counts = []
+    for minSeverity, level in SEVERITY_LEVELS:
+        count = sum(1 for hitch in hitches if hitch['level'] == level)
+        if count:
+            counts.append(f"{count} {level}")
+    return "{} ({:.1f} s): {}".format(len(hitches), sum(hitch['duration'] for hitch in hitches), ", ".join(counts))
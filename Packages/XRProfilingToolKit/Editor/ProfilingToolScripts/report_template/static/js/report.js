@@ -0,0 +1,239 @@
+// extensions of the report bundle, loaded after resource/config.js and before the bundle
+// the columnar report data is expanded to the points the bundle plots. When a metric is selected in the Data section, the bundle calls
+// prepareEntry to load its data shard if its points are not loaded yet, then decorateSpec and attachChart
+// main.b73ecf09.js is the built report app edited by hand, its source map was dropped since it no longer matches. The edits to keep
+// when the bundle is rebuilt or edited again, all guarded by window.XRReport so the bundle still runs without this file:
+// - data chart (B1): calls prepareEntry before plotting a metric without points, decorateSpec on the chart spec, attachChart after rendering
+//   and getSessionColor for the line and point colors
+// - summary: a div with class "summary" after the device specification whose ref calls renderSummary
+// - capture cards (e6): fields for which isHiddenCaptureField is true are not listed, the image is the thumbnail with the full capture as
+//   preview, and the heatmap is shown below it when the capture has one
+// - capture rows (i6): Array.from({length: t.type || 2}) columns, one per session of the report
+(function () {
+    var XRReport = window.XRReport = window.XRReport || {};
+    window.XRReportSeries = window.XRReportSeries || {};
+
+    // column of a series, either a plain array or {dtype: "float64", base64: ...} holding little endian values
+    XRReport.decodeColumn = function (column) {
+        if (Array.isArray(column)) {
+            return column;
+        }
+        var binary = atob(column.base64);
+        var bytes = new Uint8Array(binary.length);
+        for (var i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+        return new Float64Array(bytes.buffer);
+    };
+
+    // chart points of the series of a metric, session names are looked up from the report name list
+    XRReport.expandSeries = function (seriesList, names) {
+        var points = [];
+        seriesList.forEach(function (series) {
+            var x = XRReport.decodeColumn(series.x);
+            var y = XRReport.decodeColumn(series.y);
+            var name = names[series.session];
+            for (var i = 0; i < x.length; i++) {
+                points.push({ x: x[i], y: y[i], name: name });
+            }
+        });
+        return points;
+    };
+
+    // series saved in data shards are loaded when their metric is shown
+    var config = window.configJSON;
+    if (config && config.format === "columnar") {
+        config.DataSet.forEach(function (entry) {
+            if (entry.series) {
+                entry.data = XRReport.expandSeries(entry.series, config.name);
+            }
+        });
+    }
+
+    // capture fields that are not listed in the capture details, like the thumbnail, the heatmap and the raw image difference and metrics statistics
+    var HIDDEN_CAPTURE_FIELDS = ["thumbnail", "heatmap", "imageDiff", "metrics"];
+    XRReport.isHiddenCaptureField = function (key) {
+        return HIDDEN_CAPTURE_FIELDS.indexOf(key) >= 0;
+    };
+
+    // switch to the full resolution points once the zoomed range is narrower than this fraction of the session
+    var FULL_RESOLUTION_ZOOM = 0.5;
+    var seriesScripts = {};
+
+    function loadScript(src) {
+        return new Promise(function (resolve, reject) {
+            var script = document.createElement("script");
+            script.src = src;
+            script.onload = resolve;
+            script.onerror = reject;
+            document.head.appendChild(script);
+        });
+    }
+
+    // chart points of a series script, each script is only loaded once
+    XRReport.loadSeries = function (path) {
+        if (!seriesScripts[path]) {
+            seriesScripts[path] = loadScript(path).then(function () {
+                var points = XRReport.expandSeries(window.XRReportSeries[path], window.configJSON.name);
+                // the expanded points are kept by the caller
+                delete window.XRReportSeries[path];
+                return points;
+            });
+        }
+        return seriesScripts[path];
+    };
+
+    // load the points of a metric from its data shard
+    XRReport.prepareEntry = function (entry) {
+        if (entry.data) {
+            return Promise.resolve(entry);
+        }
+        XRReport.entry = entry;
+        return XRReport.loadSeries(entry.shard).then(function (points) {
+            entry.data = points;
+            // another metric was selected while loading, leave the chart to it
+            if (XRReport.entry !== entry) {
+                return new Promise(function () {});
+            }
+            return entry;
+        });
+    };
+
+    // full resolution points of a downsampled metric, null if the metric is not downsampled
+    XRReport.loadFullResolution = function (entry) {
+        if (!entry.fullResolution) {
+            return Promise.resolve(null);
+        }
+        return XRReport.loadSeries(entry.fullResolution);
+    };
+
+    // line colors of the sessions, the first two match the colors of the two session reports
+    var SESSION_COLORS = ["#4080FF", "#FF7D00", "#4CD263", "#A871E3", "#F7BA1E", "#0FC6C2", "#F979B7", "#9FDB1D"];
+    XRReport.getSessionColor = function (names, name) {
+        return SESSION_COLORS[Math.max(names.indexOf(name), 0) % SESSION_COLORS.length];
+    };
+
+    function formatStat(stats, key) {
+        return stats && stats.count ? stats[key].toFixed(2) : "—";
+    }
+
+    var VERDICT_COLORS = { improved: "#00B42A", regressed: "#F53F3F", inconclusive: "#86909C" };
+
+    function formatDifference(comparison) {
+        if (!comparison.meanCI) {
+            return comparison.verdict + " (" + comparison.reason + ")";
+        }
+        function signed(value) {
+            return (value >= 0 ? "+" : "") + value.toFixed(2);
+        }
+        return comparison.verdict + ": mean " + signed(comparison.meanDiff) + " [" + signed(comparison.meanCI[0]) + ", " + signed(comparison.meanCI[1]) + "], p95 " +
+            signed(comparison.p95Diff) + " [" + signed(comparison.p95CI[0]) + ", " + signed(comparison.p95CI[1]) + "], p=" + comparison.pValue.toPrecision(2);
+    }
+
+    // table of the statistics of every metric for each session of a comparison report, metrics a session does not have are shown as missing
+    // sessions after the first one show the verdict of their difference to it, the confidence intervals and feature states are in the tooltip
+    XRReport.renderSummary = function (element) {
+        var config = window.configJSON;
+        element.innerHTML = "";
+        if (!config || config.name.length < 2) {
+            return;
+        }
+        var table = document.createElement("table");
+        table.style.cssText = "width:100%;border-collapse:collapse;margin-top:20px;font-size:14px";
+        var cellStyle = "border:1px solid #eee;padding:4px 8px;text-align:left";
+        function addRow(cells, header) {
+            var row = table.insertRow();
+            cells.forEach(function (content) {
+                var cell = document.createElement(header ? "th" : "td");
+                cell.style.cssText = cellStyle;
+                if (typeof content === "string") {
+                    cell.textContent = content;
+                } else {
+                    cell.textContent = content.text;
+                    cell.title = content.title;
+                    cell.style.color = content.color;
+                }
+                row.appendChild(cell);
+            });
+        }
+        addRow(["Metric"].concat(config.name.map(function (name, session) {
+            return "Session " + (session + 1) + " avg (p5 / p95)";
+        })), true);
+        config.DataSet.forEach(function (entry) {
+            addRow([entry.name].concat(config.name.map(function (name) {
+                var stats = entry.stats && entry.stats[name];
+                if (!stats || !stats.count) {
+                    return "—";
+                }
+                var text = formatStat(stats, "mean") + " (" + formatStat(stats, "p5") + " / " + formatStat(stats, "p95") + ")";
+                var comparison = entry.comparison && entry.comparison[name];
+                if (!comparison) {
+                    return text;
+                }
+                var title = [formatDifference(comparison)].concat((comparison.featureStates || []).map(function (state) {
+                    return state.features + " - " + formatDifference(state);
+                }));
+                return { text: text + " " + comparison.verdict, title: title.join("\n"), color: VERDICT_COLORS[comparison.verdict] };
+            })));
+        });
+        element.appendChild(table);
+    };
+
+    var HITCH_COLORS ={ minor: "#F7BA1E", major: "#FF7D00", critical: "#F53F3F" };
+
+    // bands of the hitches found in the sessions, labeled with their session in comparison reports
+    XRReport.getHitchAreas = function () {
+        var config = window.configJSON;
+        var areas = [];
+        if (!config || !config.Hitches) {
+            return areas;
+        }
+        config.name.forEach(function (name, session) {
+            (config.Hitches[name] || []).forEach(function (hitch) {
+                areas.push({
+                    x: hitch.start,
+                    x1: hitch.end,
+                    area: { style: { fill: HITCH_COLORS[hitch.level], fillOpacity: 0.2 } },
+                    label: { text: config.name.length > 1 ? "S" + (session + 1) + " " + hitch.level : hitch.level, position: "insideTop" }
+                });
+            });
+        });
+        return areas;
+    };
+
+    // add a zoom bar below the chart and the hitch bands
+    XRReport.decorateSpec = function (spec, entry) {
+        spec.dataZoom = [{ orient: "bottom", filterMode: "filter" }];
+        var areas = XRReport.getHitchAreas();
+        if (areas.length) {
+            spec.markArea = areas;
+        }
+        return spec;
+    };
+
+    XRReport.attachChart = function (chart, entry) {
+        XRReport.entry = entry;
+        XRReport.fullResolution = false;
+        if (chart.xrReportAttached) {
+            return;
+        }
+        chart.xrReportAttached = true;
+        chart.on("dataZoomChange", function (params) {
+            var current = XRReport.entry;
+            var value = params && params.value;
+            if (!current || !value || XRReport.fullResolution || value.end - value.start > FULL_RESOLUTION_ZOOM) {
+                return;
+            }
+            XRReport.loadFullResolution(current).then(function (points) {
+                // the selected metric may have changed while loading
+                if (!points || XRReport.entry !== current) {
+                    return;
+                }
+                XRReport.fullResolution = true;
+                chart.updateDataSync(current.name, points.slice().sort(function (a, b) { return a.x - b.x; }));
+            }).catch(function (err) {
+                console.log("err: ", err);
+            });
+        });
+    };
+})();